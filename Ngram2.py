@@ -1,21 +1,85 @@
 import glob
-import regex
 import csv
+import gzip
+import os
+import pickle
 from multiprocessing import Pool
 import sys
 import nltk
+import numpy as np
+from collections import Counter
+from approx_counting import CountMinSketch, int_hashes, pair_hashes
+from phrase_model import PhraseModel, save_model
 nltk.download('stopwords')
 from nltk.corpus import stopwords
+from tokenizer import lower_tokens
 
 path = "/data/annual_reports_tesseract/*.txt"
 freq_min = 24000
 processors = 25
+
+# Files counted by a worker before it sends its (merged) counts back
+files_per_task = 20
+
+# Only counts trigram stage pairs that can reach freq_min (the counts of rarer pairs are left out of
+# trigrams_count.txt and the saved trigram counts)
+prune_rare = False
+
+# Finds the frequent pairs of the bigram and trigram stages in fixed memory with a count-min sketch (see
+# approx_counting.py), then counts only the candidates it finds exactly in a second pass over the corpus. The frequent
+# sets are still exact, but the count files only list the candidates.
+approximate_counts = False
+sketch_width = 1 << 20
+sketch_depth = 4
+
+# Pass of an approximate count the workers are in (set before each pool is made, so forked workers see it)
+sketch_pass = False
+candidate_sketch = None
 stops = set(stopwords.words("english"))
 
-csv.field_size_limit(sys.maxsize)
-text_files = glob.glob(path)
+# Full count tables of each stage are saved here, so a rerun with a different freq_min only recounts the stages the
+# new threshold actually changes
+counts_dir = "ngram_counts"
 
-word_fd = nltk.FreqDist()
+# Ngrammed copies of the text files are written here, and the learned phrases are saved to phrase_model_file (see
+# phrase_model.py, to apply them to other text without recounting)
+ngrammed_dir = "/data/annual_reports_tess_ngrammed"
+phrase_model_file = "phrase_model.npz"
+
+csv.field_size_limit(sys.maxsize)
+text_files = sorted(glob.glob(path))
+
+# Size and modification time of every text file, taken before counting, so saved counts are not reused for files that
+# were rewritten in place (e.g. re-OCRed) since they were counted
+file_stats = [(text_file, os.stat(text_file).st_size, os.stat(text_file).st_mtime_ns) for text_file in text_files]
+
+
+def load_counts(stage):
+    """
+    Loads the count table a stage saved on an earlier run
+    :param stage: str- name of the stage (unigram, bigram, trigram)
+    :return: dict- {"params": what the counts depend on, "counts": dict of gram to count}, None if there is none
+    """
+    counts_file = os.path.join(counts_dir, stage + "_counts.pkl.gz")
+    if not os.path.exists(counts_file):
+        return None
+    with gzip.open(counts_file, "rb") as inf:
+        return pickle.load(inf)
+
+
+def save_counts(stage, params, counts):
+    """
+    Saves the full count table of a stage (gzipped pickle, written atomically)
+    :param stage: str- name of the stage (unigram, bigram, trigram)
+    :param params: dict- what the counts depend on (checked by later runs before reusing them)
+    :param counts: dict- gram to count
+    :return: None
+    """
+    os.makedirs(counts_dir, exist_ok=True)
+    counts_file = os.path.join(counts_dir, stage + "_counts.pkl.gz")
+    with gzip.open(counts_file + ".tmp", "wb", compresslevel=3) as outf:
+        pickle.dump({"params": params, "counts": dict(counts)}, outf, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(counts_file + ".tmp", counts_file)
 
 
 def element_clean(gram):
@@ -29,48 +93,191 @@ def element_clean(gram):
         return gram
 
 
-def unigrams(filename):
-    with open(filename, encoding="utf-8") as f:
-        text = f.read()
-        tokens = regex.findall(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*", text)
-    return nltk.FreqDist([token.lower() for token in tokens])
-
-
-unipool = Pool(processors)
-unigram_dists = unipool.map(unigrams, text_files)
-for freqdist in unigram_dists:
-    word_fd.update(freqdist)
-unipool.close()
-unipool.join()
+def left_clean(token):
+    """
+    Whether a token can be the first word of a gram that element_clean keeps
+    :param token: str- a token
+    :return: bool- True if the token is not a stopword (and is not a bigram starting with one)
+    """
+    token_split = token.split("_")
+    return token not in stops and not (len(token_split) == 2 and token_split[0] in stops)
+
+
+def gram_ids(vocabulary):
+    """
+    Numbers a vocabulary so a pair of its tokens can be counted under a single int key (first id * size + second id)
+    instead of a tuple of strings, which is far smaller to hold and to send between processes
+    :param vocabulary: iterable- tokens that can be in a pair
+    :return: tuple- (lst- tokens by id, dict- token to id for tokens that can start a kept pair, dict- token to id
+             for tokens that can end one)
+    """
+    tokens = sorted(vocabulary)
+    left_ids = {token: token_id for token_id, token in enumerate(tokens) if left_clean(token)}
+    right_ids = {token: token_id for token_id, token in enumerate(tokens) if token not in stops}
+    return tokens, left_ids, right_ids
+
+
+def decode_pairs(pair_counts, tokens):
+    """
+    Turns int keyed pair counts (see gram_ids) back into (first token, second token) keyed counts
+    :param pair_counts: dict- int key to count
+    :param tokens: lst- tokens by id
+    :return: Counter- pair to count
+    """
+    size = len(tokens)
+    return Counter({(tokens[key // size], tokens[key % size]): count for key, count in pair_counts.items()})
+
+
+def file_batches():
+    """
+    :return: lst- text_files split into batches of files_per_task
+    """
+    return [text_files[i:i + files_per_task] for i in range(0, len(text_files), files_per_task)]
+
+
+def batch_counts():
+    """
+    :return: Counter (or CountMinSketch in the first pass of an approximate count) for a worker to count a batch into
+    """
+    if sketch_pass:
+        return CountMinSketch(sketch_width, sketch_depth, dtype=np.uint32)
+    return Counter()
+
+
+def tally(counts, keys, hash_keys):
+    """
+    Adds the pairs of a file to the counts of a batch. In an approximate count the first pass adds them to the batch's
+    sketch, and the second only counts the candidates whose estimate in the merged sketch reaches freq_min.
+    :param counts: Counter or CountMinSketch- counts of the batch (see batch_counts)
+    :param keys: lst- pairs (int keys or tuples) of the file
+    :param hash_keys: function- hashes a list of keys for the sketch (int_hashes or pair_hashes)
+    :return: None
+    """
+    if sketch_pass:
+        counts.add(hash_keys(keys))
+    elif candidate_sketch is not None:
+        estimates = candidate_sketch.query(hash_keys(keys))
+        counts.update(key for key, estimate in zip(keys, estimates) if estimate >= freq_min)
+    else:
+        counts.update(keys)
+
+
+def count_stage(count_batch, pool_size, counts=None):
+    """
+    Counts grams over all text files. Each worker merges the counts of a whole batch of files before sending them
+    back, and the parent merges each batch into one table as it arrives, so only the merged table and the batches in
+    flight are ever held in memory.
+    :param count_batch: function- counts the grams of a list of files into a Counter
+    :param pool_size: int- number of worker processes
+    :param counts: Counter or CountMinSketch- table to merge into, None for a new Counter
+    :return: Counter- gram to count over all the files
+    """
+    if counts is None:
+        counts = Counter()
+    pool = Pool(pool_size)
+    for batch_counts in pool.imap_unordered(count_batch, file_batches()):
+        counts.update(batch_counts)
+    pool.close()
+    pool.join()
+    return counts
+
+
+def pair_counts(count_batch, pool_size, stage):
+    """
+    Counts the pairs of a stage, exactly or (with approximate_counts) in two passes through a count-min sketch
+    :param count_batch: function- counts the pairs of a list of files (see tally)
+    :param pool_size: int- number of worker processes
+    :param stage: str- name of the stage, for the report
+    :return: Counter- pair to count (only the candidates of an approximate count)
+    """
+    global sketch_pass, candidate_sketch
+    if not approximate_counts:
+        return count_stage(count_batch, pool_size)
+
+    sketch_pass = True
+    sketch = count_stage(count_batch, pool_size, CountMinSketch(sketch_width, sketch_depth))
+    sketch_pass = False
+    candidate_sketch = sketch
+    counts = count_stage(count_batch, pool_size)
+    candidate_sketch = None
+
+    # Estimates are never below the true counts, so no frequent pair is missed
+    error, probability = sketch.error_bound()
+    frequent = sum(1 for count in counts.values() if count >= freq_min)
+    print("{0} sketch: {1} pairs, estimates at most {2:.0f} over (probability {3:.3f}), {4} candidates, {5} frequent"
+          .format(stage, sketch.total, error, probability, len(counts), frequent))
+    return counts
+
+
+def unigrams(filenames):
+    counts = Counter()
+    for filename in filenames:
+        with open(filename, encoding="utf-8") as f:
+            text = f.read()
+            counts.update(lower_tokens(text))
+    return counts
+
+
+# Unigram counts only depend on the corpus
+unigram_params = {"files": file_stats}
+saved = load_counts("unigram")
+if saved is not None and saved["params"] == unigram_params:
+    word_fd = Counter(saved["counts"])
+    print("Loaded unigram counts")
+else:
+    word_fd = count_stage(unigrams, processors)
+    save_counts("unigram", unigram_params, word_fd)
+del saved
 
 # Only keeps the most frequent unigrams
 word_fd_frequent = set([word for word, count in word_fd.items() if count >= freq_min])
 
-del unigram_dists
 del word_fd
 
-bigram_fd = nltk.FreqDist()
 print("Unigrams complete")
 
-
-def bigrams(filename):
-    with open(filename, encoding="utf-8") as f:
-        text = f.read()
-        tokens = regex.findall(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*", text)
-        bigrams = nltk.bigrams(token.lower() for token in tokens)
-        bigrams_filtered = [bigram for bigram in bigrams if bigram[0] in word_fd_frequent and bigram[1] in word_fd_frequent]
-    del bigrams
-    bigrams_cleaned = [bigram for bigram in bigrams_filtered if element_clean(bigram) != ""]
-    del bigrams_filtered
-    return nltk.FreqDist(bigrams_cleaned)
-
-
-bipool = Pool(processors)
-bigram_dists = bipool.map(bigrams, text_files)
-for freqdist in bigram_dists:
-    bigram_fd.update(freqdist)
-bipool.close()
-bipool.join()
+# Ids of the frequent unigrams, the only words bigrams are counted for
+unigram_tokens, unigram_left_ids, unigram_right_ids = gram_ids(word_fd_frequent)
+
+
+def bigrams(filenames):
+    counts = batch_counts()
+    size = len(unigram_tokens)
+    for filename in filenames:
+        with open(filename, encoding="utf-8") as f:
+            text = f.read()
+            tokens = lower_tokens(text)
+        # Pairs of frequent unigrams that element_clean keeps
+        first_ids = map(unigram_left_ids.get, tokens)
+        second_ids = map(unigram_right_ids.get, tokens[1:])
+        tally(counts, [first * size + second for first, second in zip(first_ids, second_ids)
+                       if first is not None and second is not None], int_hashes)
+    return counts
+
+
+def reusable(params):
+    """
+    Whether saved pair counts hold every pair this run needs. Counts that only list some pairs (pruned or approximate)
+    hold every pair that reached the freq_min they were saved with, so they serve that or any stricter freq_min.
+    :param params: dict- params the counts were saved with
+    :return: bool- True if they can be used instead of recounting
+    """
+    if "complete" not in params or params["files"] != file_stats or params["freq_min"] > freq_min:
+        return False
+    return params["complete"] or prune_rare or approximate_counts
+
+
+# Bigram counts only cover pairs of frequent unigrams, so counts saved with a lower (or equal) freq_min hold every
+# pair needed now and are filtered down instead of recounted
+saved = load_counts("bigram")
+if saved is not None and reusable(saved["params"]):
+    bigram_fd = Counter({bigram: count for bigram, count in saved["counts"].items()
+                         if bigram[0] in word_fd_frequent and bigram[1] in word_fd_frequent})
+    print("Loaded bigram counts")
+else:
+    bigram_fd = decode_pairs(pair_counts(bigrams, processors, "bigram"), unigram_tokens)
+    save_counts("bigram", {"files": file_stats, "freq_min": freq_min, "complete": not approximate_counts}, bigram_fd)
+del saved
 
 with open("bigrams_count.txt", "w", encoding="utf-8") as out:
     for word, count in bigram_fd.items():
@@ -80,50 +287,65 @@ with open("bigrams_count.txt", "w", encoding="utf-8") as out:
 
 # Only keeps the frequent bigrams
 bigram_fd_frequent = set([word for word, count in bigram_fd.items() if count >= freq_min])
-del bigram_dists
 del bigram_fd
 
+# With pruning, pairs in the trigram stage are only counted between tokens that can be part of a frequent pair: a
+# pair never occurs more often than either of its tokens, so that is a frequent unigram or a joined frequent bigram
+if prune_rare:
+    trigram_tokens, trigram_left_ids, trigram_right_ids = gram_ids(
+        word_fd_frequent | set(bigram[0] + "_" + bigram[1] for bigram in bigram_fd_frequent))
 del word_fd_frequent
+del unigram_tokens, unigram_left_ids, unigram_right_ids
 
 print("bigram complete")
 
-bigram_trigram_fd = nltk.FreqDist()
 
-
-def trigrams(filename):
-    with open(filename, encoding="utf-8") as f:
-        text = f.read()
-        tokens = regex.findall(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*", text)
-        tokens = [token.lower() for token in tokens]
-
-        updated_tokens = []
-        previous_token = None
-        for token in tokens:
-            if previous_token and (previous_token, token) in bigram_fd_frequent:
-                token = previous_token + '_' + token
-                updated_tokens[-1] = token
-                # word_fd_frequent.add(token)
-            else:
-                updated_tokens.append(token)
-            previous_token = token
-        
-        del tokens
-        bigrams = nltk.bigrams(token.lower() for token in updated_tokens)
+def trigrams(filenames):
+    counts = batch_counts()
+    for filename in filenames:
+        with open(filename, encoding="utf-8") as f:
+            text = f.read()
+            tokens = lower_tokens(text)
+
+            updated_tokens = []
+            previous_token = None
+            for token in tokens:
+                if previous_token and (previous_token, token) in bigram_fd_frequent:
+                    token = previous_token + '_' + token
+                    updated_tokens[-1] = token
+                    # word_fd_frequent.add(token)
+                else:
+                    updated_tokens.append(token)
+                previous_token = token
+
+            del tokens
+        if prune_rare:
+            size = len(trigram_tokens)
+            first_ids = map(trigram_left_ids.get, updated_tokens)
+            second_ids = map(trigram_right_ids.get, updated_tokens[1:])
+            tally(counts, [first * size + second for first, second in zip(first_ids, second_ids)
+                           if first is not None and second is not None], int_hashes)
+        else:
+            bigrams = zip(updated_tokens, updated_tokens[1:])
+            tally(counts, [bigram for bigram in bigrams if element_clean(bigram) != ""], pair_hashes)
         del updated_tokens
-        bigrams_cleaned_of_stopwords = [bigram for bigram in bigrams if element_clean(bigram) != ""]
-        del bigrams
-    new_temp_fd = nltk.FreqDist(bigrams_cleaned_of_stopwords)
-    del bigrams_cleaned_of_stopwords
-    return new_temp_fd
-
-
-tripool = Pool(20)
-trigram_dists = tripool.map(trigrams, text_files)
-for freqdist in trigram_dists:
-    bigram_trigram_fd.update(freqdist)
-del trigram_dists
-tripool.close()
-tripool.join()
+    return counts
+
+
+# Trigram counts depend on which bigrams were joined, so they are only reused if the frequent bigrams are the same
+saved = load_counts("trigram")
+if saved is not None and saved["params"]["frequent_bigrams"] == bigram_fd_frequent and reusable(saved["params"]):
+    bigram_trigram_fd = Counter(saved["counts"])
+    print("Loaded trigram counts")
+else:
+    bigram_trigram_fd = pair_counts(trigrams, 20, "trigram")
+    if prune_rare:
+        bigram_trigram_fd = decode_pairs(bigram_trigram_fd, trigram_tokens)
+    save_counts("trigram", {"files": file_stats, "frequent_bigrams": bigram_fd_frequent, "freq_min": freq_min,
+                            "complete": not (prune_rare or approximate_counts)}, bigram_trigram_fd)
+del saved
+if prune_rare:
+    del trigram_tokens, trigram_left_ids, trigram_right_ids
 print("trigrams almost done")
 
 with open("trigrams_count.txt", "w", encoding="utf-8") as out:
@@ -135,41 +357,25 @@ with open("trigrams_count.txt", "w", encoding="utf-8") as out:
 bigram_trigram_fd_frequent = set([word for word, count in bigram_trigram_fd.items() if count >= freq_min])
 del bigram_trigram_fd
 
+# Saves the learned phrases, which ngram every text file in the same two passes
+phrase_model = PhraseModel(bigram_fd_frequent, bigram_trigram_fd_frequent)
+save_model(phrase_model_file, phrase_model)
+del bigram_fd_frequent
+del bigram_trigram_fd_frequent
+
 print("trigrams complete\nwriting...")
 
 
 def filewriter(filename):
     with open(filename, encoding="utf-8") as f:
         text = f.read()
-        tokens = regex.findall(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*", text)
-        tokens = [token.lower() for token in tokens]
-
-        updated_tokens = []
-        previous_token = None
-        for token in tokens:
-            if previous_token and (previous_token, token) in bigram_fd_frequent:
-                token = previous_token + '_' + token
-                updated_tokens[-1] = token
-            else:
-                updated_tokens.append(token)
-            previous_token = token
-
-        updated_tokens_tri = []
-        previous_token = None
-        for token in updated_tokens:
-            if previous_token and (previous_token, token) in bigram_trigram_fd_frequent:
-                token = previous_token + '_' + token
-                updated_tokens_tri[-1] = token
-            else:
-                updated_tokens_tri.append(token)
-            previous_token = token
-
-        updated_text = ' '.join(updated_tokens_tri)
-        new_file_name = "/data/annual_reports_tess_ngrammed/" + filename[31:-4] + "_ngrammed.txt"
+        updated_text = phrase_model.phrase_text(text)
+        new_file_name = os.path.join(ngrammed_dir, os.path.basename(filename)[:-4] + "_ngrammed.txt")
         with open(new_file_name, "w", encoding="utf-8") as outf:
             outf.write(updated_text)
 
 
+os.makedirs(ngrammed_dir, exist_ok=True)
 writepool = Pool(processors)
 writepool.map(filewriter, text_files)
 writepool.close()
@@ -4,78 +4,541 @@ Takes a pdf and turns it into text file via tesseract OCR software (Note: This c
 and tesseract is slow.
 """
 import pytesseract as tess
-import PIL
-from pdf2image import convert_from_path
+import PIL.Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+from multiprocessing import Pool
+import io
+import json
+import ocr_cache
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 
+# Tesseract install location (requires tesseract download on running machine)
+tesseract_path = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
-def pdf_to_image(pdf_name, temp_file_name):
+# Parallel OCR settings: pool size, threads each tesseract call may use, and pages handed to a worker at a time
+parallel_ocr = True
+processes = os.cpu_count()
+tesseract_threads = 1
+pages_per_task = 10
+
+# Pages rendered at once, peak memory grows with this (not with the length of the pdf)
+render_window = 2
+
+# Rendering and preprocessing used for OCR. ocr_benchmark.py measures these settings and writes the recommended ones to
+# ocr_profile_file, which is loaded over the defaults below when it exists. ocr_image_format None hands the rendered
+# page to tesseract as is, "JPEG" or "PNG" passes it through that encoding first
+ocr_dpi = 200
+ocr_grayscale = False
+ocr_binarize_threshold = None
+ocr_image_format = None
+ocr_profile_file = "ocr_profile.json"
+
+# Born-digital pdfs: pages whose embedded text layer looks usable skip OCR. A layer is usable when it has enough
+# visible characters, they are mostly letters/digits, and its words have a believable average length
+use_text_layer = True
+min_text_layer_chars = 40
+min_text_layer_alnum_ratio = 0.6
+text_layer_word_length_range = (2, 12)
+
+# Persistent page cache keyed by pdf contents, OCR settings and page (None turns caching off)
+ocr_cache_dir = "ocr_cache"
+
+# Run wide log of per pdf timings (one line per converted pdf), None turns it off
+ocr_timing_log = "ocr_timings.tsv"
+
+
+def load_ocr_profile(profile_file):
+    """
+    Loads the rendering and preprocessing settings recommended by ocr_benchmark.py (if the profile exists).
+    :param profile_file: str- path to the json profile
+    :return: dict- the loaded profile, None if there is no profile
+    """
+    if profile_file is None or not os.path.exists(profile_file):
+        return None
+    with open(profile_file, "r", encoding="utf-8") as inf:
+        profile = json.load(inf)
+    apply_render_settings(profile)
+    return profile
+
+
+def render_settings():
+    """
+    Gets the rendering and preprocessing settings currently in use (the keys of a profile they depend on).
+    :return: dict- dpi, grayscale, binarize_threshold, image_format
+    """
+    return {"dpi": ocr_dpi, "grayscale": ocr_grayscale, "binarize_threshold": ocr_binarize_threshold,
+            "image_format": ocr_image_format}
+
+
+def apply_render_settings(settings):
+    """
+    Sets the rendering and preprocessing settings used for OCR.
+    :param settings: dict- dpi, grayscale, binarize_threshold, image_format (e.g. a profile, or render_settings())
+    :return: None
+    """
+    global ocr_dpi, ocr_grayscale, ocr_binarize_threshold, ocr_image_format
+    ocr_dpi = settings["dpi"]
+    ocr_grayscale = settings["grayscale"]
+    ocr_binarize_threshold = settings["binarize_threshold"]
+    ocr_image_format = settings["image_format"]
+
+
+def prepare_page(page, binarize_threshold=None, image_format=None):
+    """
+    Applies the preprocessing steps to a rendered page before OCR.
+    :param page: PIL image- rendered page
+    :param binarize_threshold: int- gray level (0-255) splitting black from white, None to keep the page as is
+    :param image_format: str- "JPEG" or "PNG" to pass the page through that encoding, None to keep it in memory as is
+    :return: PIL image- page ready for tesseract
+    """
+    if binarize_threshold is not None:
+        page = page.convert("L").point(lambda level: 255 if level > binarize_threshold else 0, mode="1")
+    if image_format is not None:
+        encoded = io.BytesIO()
+        page.convert("L" if page.mode in ("1", "L") else "RGB").save(encoded, image_format)
+        encoded.seek(0)
+        page = PIL.Image.open(encoded)
+    return page
+
+
+def render_pages(pdf_name, first_page=None, last_page=None, window=render_window, dpi=None, grayscale=None):
+    """
+    Streams the pages of a pdf as PIL images, rendering only window pages at a time so memory stays bounded by
+    the window size rather than the page count.
+    :param pdf_name: str- path to the pdf being rendered
+    :param first_page: int- first page to render (1 indexed), None for the start of the pdf
+    :param last_page: int- last page to render (inclusive), None for the end of the pdf
+    :param window: int- number of pages rendered by each call to pdftoppm
+    :param dpi: int- render resolution, None for ocr_dpi
+    :param grayscale: bool- render in grayscale, None for ocr_grayscale
+    :return: generator- (int- page number, PIL image, float- ms spent rendering the page) for each page in order
+    """
+    if first_page is None:
+        first_page = 1
+    if last_page is None:
+        last_page = pdfinfo_from_path(pdf_name)["Pages"]
+    if dpi is None:
+        dpi = ocr_dpi
+    if grayscale is None:
+        grayscale = ocr_grayscale
+
+    for window_start in range(first_page, last_page + 1, window):
+        window_end = min(window_start + window - 1, last_page)
+        start = time.perf_counter()
+        pages = convert_from_path(pdf_name, dpi=dpi, first_page=window_start, last_page=window_end,
+                                  grayscale=grayscale)
+        render_ms = (time.perf_counter() - start) * 1000 / max(len(pages), 1)
+        for page_number, page in enumerate(pages, window_start):
+            yield page_number, page, render_ms
+            page.close()
+        del pages
+
+
+def embedded_page_texts(pdf_name, first_page, last_page):
+    """
+    Pulls the embedded text layer of a range of pages using poppler's pdftotext (installed alongside pdf2image).
+    :param pdf_name: str- path to the pdf
+    :param first_page: int- first page of the range (1 indexed)
+    :param last_page: int- last page of the range (inclusive)
+    :return: lst- text of each page in the range (empty strings when the pdf has no readable text layer)
+    """
+    page_count = last_page - first_page + 1
+    try:
+        result = subprocess.run(["pdftotext", "-enc", "UTF-8", "-f", str(first_page), "-l", str(last_page),
+                                 pdf_name, "-"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return [""] * page_count
+
+    # pdftotext ends every page with a form feed
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")[:page_count]
+    pages.extend([""] * (page_count - len(pages)))
+    return pages
+
+
+def text_layer_usable(text):
+    """
+    Decides if the embedded text of a page can be used as is, or if the page is scanned/garbled and needs OCR.
+    :param text: str- embedded text of the page
+    :return: bool- True if the text layer looks like real text
+    """
+    words = text.split()
+    visible = "".join(words)
+    if len(visible) < min_text_layer_chars:
+        return False
+    alnum_ratio = sum(1 for char in visible if char.isalnum()) / len(visible)
+    average_word_length = len(visible) / len(words)
+    return (alnum_ratio >= min_text_layer_alnum_ratio and
+            text_layer_word_length_range[0] <= average_word_length <= text_layer_word_length_range[1])
+
+
+def pdf_page_texts(pdf_name, first_page=None, last_page=None, window=render_window, page_dir=None):
+    """
+    Streams the text of each page of a pdf, taking it from the page cache if it is there, from the embedded text layer
+    when that is usable, and running tesseract on the rendered page otherwise.
+    :param pdf_name: str- path to the pdf
+    :param first_page: int- first page (1 indexed), None for the start of the pdf
+    :param last_page: int- last page (inclusive), None for the end of the pdf
+    :param window: int- number of pages rendered at a time for OCR
+    :param page_dir: str- page cache directory of the pdf (see ocr_cache.page_cache_path), None to skip the cache
+    :return: generator- (int- page number, str- page text, str- "text" or "ocr" for the path used, float- ms spent
+             rendering, float- ms spent on OCR (or on pulling the text layer)) for each page, cached pages take 0 ms
+    """
+    if first_page is None:
+        first_page = 1
+    if last_page is None:
+        last_page = pdfinfo_from_path(pdf_name)["Pages"]
+    page_count = last_page - first_page + 1
+
+    if page_dir is not None:
+        cached = [ocr_cache.load_cached_page(page_dir, number) for number in range(first_page, last_page + 1)]
+    else:
+        cached = [None] * page_count
+
+    # Only looks at the text layer if some pages still have to be converted
+    text_layer_ms = 0
+    if use_text_layer and None in cached:
+        start = time.perf_counter()
+        embedded = embedded_page_texts(pdf_name, first_page, last_page)
+        text_layer_ms = (time.perf_counter() - start) * 1000 / page_count
+    else:
+        embedded = [""] * page_count
+    usable = [text_layer_usable(text) for text in embedded]
+
+    page_number = first_page
+    while page_number <= last_page:
+        index = page_number - first_page
+        if cached[index] is not None:
+            yield page_number, cached[index][0], cached[index][1], 0, 0
+            page_number += 1
+            continue
+        if usable[index]:
+            if page_dir is not None:
+                ocr_cache.store_cached_page(page_dir, page_number, embedded[index], "text")
+            yield page_number, embedded[index], "text", 0, text_layer_ms
+            page_number += 1
+            continue
+
+        # Renders the whole run of consecutive uncached pages that need OCR together
+        run_end = page_number
+        while run_end < last_page and cached[run_end + 1 - first_page] is None and not usable[run_end + 1 - first_page]:
+            run_end += 1
+        for ocr_page_number, page, render_ms in render_pages(pdf_name, page_number, run_end, window):
+            start = time.perf_counter()
+            page_text = tess.image_to_string(prepare_page(page, ocr_binarize_threshold, ocr_image_format))
+            ocr_ms = (time.perf_counter() - start) * 1000
+            if page_dir is not None:
+                ocr_cache.store_cached_page(page_dir, ocr_page_number, page_text, "ocr")
+            yield ocr_page_number, page_text, "ocr", render_ms, ocr_ms + text_layer_ms
+        page_number = run_end + 1
+
+
+def record_pages(page_stream, records):
+    """
+    Passes on the text of each page from pdf_page_texts while keeping a record of how each page was made.
+    :param page_stream: generator- output of pdf_page_texts
+    :param records: lst- list the (page number, path used, characters produced, render ms, OCR ms) records are
+                    appended to
+    :return: generator- text of each page
+    """
+    for page_number, page_text, source, render_ms, ocr_ms in page_stream:
+        records.append((page_number, source, len(page_text), render_ms, ocr_ms))
+        yield page_text
+
+
+def dehyphenate(pieces):
+    """
+    Removes line break hyphens ("-\n") from a stream of text, including ones split between two pieces, without ever
+    rescanning text that was already passed on.
+    :param pieces: iterable- strings in document order (e.g. page texts)
+    :return: generator- de-hyphenated strings
     """
-    Takes a pdf and turns it into a jpg that can be read by tesseract.
-    :param pdf_name: str- path to the pdf being converted
-    :param temp_file_name: str- place to store image pages separately
-    :return: lst- list of jpg file names each representing a page of the original pdf
+    carry = ""
+    for piece in pieces:
+        piece = carry + piece
+        # Removing one "-\n" can bring a hyphen and a new line together ("--\n\n"), so repeats until none are left
+        while "-\n" in piece:
+            piece = piece.replace("-\n", "")
+
+        # Trailing hyphens may be the start of a "-\n" finished by the next piece
+        kept = piece.rstrip("-")
+        carry = piece[len(kept):]
+        yield kept
+    yield carry
+
+
+def write_pdf_text(pdf_name, pieces):
+    """
+    Streams the de-hyphenated text of a pdf into its text file (atomically, the file is either absent or complete).
+    :param pdf_name: str- path to the pdf
+    :param pieces: iterable- page texts in page order
+    :return: None
+    """
+    output = pdf_name[:-3] + "txt"
+    temp_output = output + "." + str(os.getpid()) + ".tmp"
+    with open(temp_output, "w") as out_file:
+        for piece in dehyphenate(pieces):
+            out_file.write(piece)
+    os.replace(temp_output, output)
+
+
+def write_page_log(pdf_name, records):
+    """
+    Writes the per page record of a converted pdf next to its text file (<pdf name>.pages.tsv), and adds a line
+    for the pdf as a whole to the run's timing log.
+    :param pdf_name: str- path to the pdf
+    :param records: lst- (page number, path used, characters produced, render ms, OCR ms) tuple for each page
+    :return: None
+    """
+    lines = ["page\tsource\tchars\trender_ms\tocr_ms\n"]
+    lines.extend("{0}\t{1}\t{2}\t{3:.1f}\t{4:.1f}\n".format(*record) for record in records)
+    atomic_write(pdf_name[:-3] + "pages.tsv", "".join(lines))
+
+    # Pages per second are based on the time spent on the pdf's pages (so they compare across serial and pool runs)
+    pages = len(records)
+    ocr_pages = sum(1 for record in records if record[1] == "ocr")
+    chars = sum(record[2] for record in records)
+    render_ms = sum(record[3] for record in records)
+    ocr_ms = sum(record[4] for record in records)
+    total_seconds = (render_ms + ocr_ms) / 1000
+    pages_per_sec = pages / total_seconds if total_seconds > 0 else 0
+    print("{0}: {1} pages ({2} OCR), {3:.2f} pages/sec".format(pdf_name, pages, ocr_pages, pages_per_sec))
+    if ocr_timing_log is not None:
+        with open(ocr_timing_log, "a", encoding="utf-8") as log:
+            log.write("{0}\t{1}\t{2}\t{3}\t{4:.1f}\t{5:.1f}\t{6:.3f}\n".format(pdf_name, pages, ocr_pages, chars,
+                                                                              render_ms, ocr_ms, pages_per_sec))
+
+
+def ocr_settings():
+    """
+    Gets the settings that change what text comes out of a page (part of the page cache key).
+    :return: dict- setting name to value
     """
-    # Creates a list of pages
-    pages = convert_from_path(pdf_name)
+    return {"use_text_layer": use_text_layer, "min_text_layer_chars": min_text_layer_chars,
+            "min_text_layer_alnum_ratio": min_text_layer_alnum_ratio,
+            "text_layer_word_length_range": list(text_layer_word_length_range), "dpi": ocr_dpi,
+            "grayscale": ocr_grayscale, "binarize_threshold": ocr_binarize_threshold, "image_format": ocr_image_format,
+            "tesseract": str(tess.get_tesseract_version())}
 
-    # Variable initialization
-    page_number = 1
-    file_name_list = []
 
-    # Goes through pages to create a temporary JPEG file for each pdf page
-    for page in pages:
-        file_name = temp_file_name + str(page_number) + ".jpg"
-        # Page is a PIL image type and save is a PIL function
-        page.save(file_name, "JPEG")
-        page_number = page_number + 1
-        file_name_list.append(file_name)
-    return file_name_list
+def cache_lookup(manifest, pdf_name, settings, entry=None):
+    """
+    Checks a pdf against the cache manifest.
+    :param manifest: dict- manifest from ocr_cache.load_manifest
+    :param pdf_name: str- path to the pdf
+    :param settings: str- settings key of the run
+    :param entry: dict- entry of the pdf already built by ocr_cache.pdf_entry (e.g. in a pool worker), None to build it
+    :return: tuple- (bool- True if the pdf is already converted, dict- manifest entry, str- page cache directory)
+    """
+    if entry is None:
+        entry = ocr_cache.pdf_entry(manifest, pdf_name, settings)
+    if entry["status"] == "done" and os.path.exists(pdf_name[:-3] + "txt"):
+        return True, entry, None
+    if manifest.get(pdf_name) != entry:
+        # Remembers the hash right away so an interrupted run does not need to hash the pdf again
+        ocr_cache.record_pdf(ocr_cache_dir, manifest, pdf_name, entry)
+    return False, entry, ocr_cache.page_cache_path(ocr_cache_dir, entry["hash"], settings)
 
 
-def tesseract_pdf_reader(file_list, temp_file_name):
+def tesseract_pdf_reader(file_list, window=render_window):
     """
     Turns a list of pdfs into a set of text documents by the same name.
     :param file_list: lst- list of pdf file names/paths for files that will be converted to text
-    :param temp_file_name: str- the temporary_file_name used to create the jpgs
+    :param window: int- number of pages rendered at a time
     :return: None
     """
-    # Sets max pages for temp_file deletion later
-    max_page_count = 0
-
     # Sets tesseract path (requires tesseract download on running machine)
-    tess.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+    tess.pytesseract.tesseract_cmd = tesseract_path
+
+    if ocr_cache_dir is not None:
+        manifest = ocr_cache.load_manifest(ocr_cache_dir)
+        settings = ocr_cache.settings_key(ocr_settings())
 
     for elem in file_list:
-        # Counts pages in file
-        page_count = 0
-        # Creates outfile
-        output = elem[:-3] + "txt"
-        with open(output, "w") as out_file:
-
-            # Turns pdf file into several temporary image files (1 per page)
-            page_list = pdf_to_image(elem, temp_file_name)
-            text = ""
-
-            # Goes through image pages and converts from images to strings using Tesseract-OCR
-            # Note: Due to OCR, small print, warped print, or non-english letters may be confused for other
-            # letter. Poorly formatted documents also may have contact improperly read.
-            for page in page_list:
-                page_count += 1
-                text = text + tess.image_to_string(page)
-                text = text.replace("-\n", "")
-            out_file.write(text)
-        if page_count > max_page_count:
-            max_page_count = page_count
+        # Skips pdfs already converted with the same contents and settings, otherwise resumes from cached pages
+        page_dir = None
+        if ocr_cache_dir is not None:
+            done, entry, page_dir = cache_lookup(manifest, elem, settings)
+            if done:
+                print("TEXT CONVERSION CACHED: " + elem)
+                continue
+
+        # Takes born-digital pages from the text layer, and streams the other page images straight into
+        # Tesseract-OCR (no temporary image files). Page texts are written out as they come.
+        # Note: Due to OCR, small print, warped print, or non-english letters may be confused for other
+        # letter. Poorly formatted documents also may have contact improperly read.
+        records = []
+        write_pdf_text(elem, record_pages(pdf_page_texts(elem, window=window, page_dir=page_dir), records))
+        write_page_log(elem, records)
+        if ocr_cache_dir is not None:
+            ocr_cache.record_pdf(ocr_cache_dir, manifest, elem, dict(entry, status="done"))
         print("TEXT CONVERSION DONE: " + elem)
 
-    # Erase temporary files
-    for i in range(1, max_page_count + 1):
-        os.remove(temp_file_name + str(i) + ".jpg")
+
+def ocr_worker_init(tess_threads, run_temp_dir, settings):
+    """
+    Prepares a pool process for OCR. Caps the threads tesseract may use so that the pool (not tesseract) fills the
+    cores, and gives the process its own temp directory so workers never overwrite each other's page images.
+    :param tess_threads: int- max threads for each tesseract call
+    :param run_temp_dir: str- temp directory of the whole run, worker directories are made inside of it
+    :param settings: dict- rendering and preprocessing settings of the parent (see render_settings), so workers OCR
+                     with the settings the page cache is keyed on
+    :return: None
+    """
+    os.environ["OMP_THREAD_LIMIT"] = str(tess_threads)
+    tess.pytesseract.tesseract_cmd = tesseract_path
+    apply_render_settings(settings)
+    worker_temp_dir = tempfile.mkdtemp(prefix="worker_" + str(os.getpid()) + "_", dir=run_temp_dir)
+
+    # pytesseract hands in-memory pages to tesseract through temp files, keeps those in the worker's directory too
+    tempfile.tempdir = worker_temp_dir
+
+
+def ocr_page_range(task):
+    """
+    OCRs a range of pages of a pdf inside a pool worker.
+    :param task: tuple- (str- pdf path, int- first page, int- last page, str- page cache directory or None)
+    :return: tuple- (str- pdf path, int- first page, str- text of the pages or None if the pages failed,
+             lst- page records (see write_page_log))
+    """
+    pdf_name, first_page, last_page, page_dir = task
+    records = []
+    try:
+        texts = list(record_pages(pdf_page_texts(pdf_name, first_page, last_page, page_dir=page_dir), records))
+    except Exception:
+        print("OCR ERROR: " + pdf_name + " pages " + str(first_page) + "-" + str(last_page) + " " +
+              str(sys.exc_info()[1]))
+        return pdf_name, first_page, None, records
+    return pdf_name, first_page, "".join(texts), records
+
+
+def plan_pdf(task):
+    """
+    Works out what a pdf needs inside a pool worker: its manifest entry (which hashes the pdf if it is new or changed)
+    and its page count, so the pdfs of a run are planned across the pool instead of one after another in the parent.
+    :param task: tuple- (str- pdf path, dict- its manifest entry from earlier runs or None, str- settings key of the run
+                 or None when caching is off)
+    :return: tuple- (str- pdf path, dict- manifest entry or None when caching is off, int- page count or None if the
+             pdf is already converted), entry and page count are both None if the pdf could not be read
+    """
+    pdf_name, known, settings = task
+    entry = None
+    try:
+        if settings is not None:
+            entry = ocr_cache.pdf_entry({pdf_name: known} if known is not None else {}, pdf_name, settings)
+            if entry["status"] == "done" and os.path.exists(pdf_name[:-3] + "txt"):
+                return pdf_name, entry, None
+        return pdf_name, entry, pdfinfo_from_path(pdf_name)["Pages"]
+    except Exception:
+        print("PLAN ERROR: " + pdf_name + " " + str(sys.exc_info()[1]))
+        return pdf_name, None, None
+
+
+def page_range_tasks(pdf_name, page_count, per_task, page_dir=None):
+    """
+    Splits a pdf into tasks of at most per_task pages each.
+    :param pdf_name: str- path to the pdf
+    :param page_count: int- number of pages in the pdf
+    :param per_task: int- max pages per task
+    :param page_dir: str- page cache directory of the pdf, None to skip the cache
+    :return: lst- list of (pdf path, first page, last page, page cache directory) tuples
+    """
+    return [(pdf_name, first, min(first + per_task - 1, page_count), page_dir)
+            for first in range(1, page_count + 1, per_task)]
+
+
+def atomic_write(output, text):
+    """
+    Writes text to a file so that the file is either absent or complete (never half written).
+    :param output: str- path of the file to write
+    :param text: str- text to write
+    :return: None
+    """
+    temp_output = output + "." + str(os.getpid()) + ".tmp"
+    with open(temp_output, "w") as out_file:
+        out_file.write(text)
+    os.replace(temp_output, output)
+
+
+def parallel_tesseract_pdf_reader(file_list, num_processes=processes, tess_threads=tesseract_threads,
+                                  per_task=pages_per_task):
+    """
+    Parallel version of tesseract_pdf_reader. Pages of every pdf are split into tasks spread across a process pool,
+    and each pdf's text file is written (atomically) once all of its pages are done.
+    :param file_list: lst- list of pdf file names/paths for files that will be converted to text
+    :param num_processes: int- number of pool workers
+    :param tess_threads: int- max threads for each tesseract call
+    :param per_task: int- max pages given to a worker at a time
+    :return: None
+    """
+    tess.pytesseract.tesseract_cmd = tesseract_path
+    manifest = {}
+    settings = None
+    if ocr_cache_dir is not None:
+        manifest = ocr_cache.load_manifest(ocr_cache_dir)
+        settings = ocr_cache.settings_key(ocr_settings())
+
+    run_temp_dir = tempfile.mkdtemp(prefix="ocr_run_")
+    try:
+        with Pool(num_processes, initializer=ocr_worker_init, initargs=(tess_threads, run_temp_dir,
+                                                                            render_settings())) as pool:
+            # Plans the pdfs across the pool (hashing and page counts), then builds the tasks. A pdf's ranges are
+            # kept next to each other so pdfs finish (and free memory) in order
+            tasks = []
+            pending = {}
+            entries = {}
+            plan_tasks = [(elem, manifest.get(elem), settings) for elem in file_list]
+            for elem, entry, page_count in pool.imap_unordered(plan_pdf, plan_tasks):
+                if entry is None and page_count is None:
+                    print("TEXT CONVERSION FAILED: " + elem)
+                    continue
+                page_dir = None
+                if ocr_cache_dir is not None:
+                    done, entries[elem], page_dir = cache_lookup(manifest, elem, settings, entry)
+                    if done:
+                        print("TEXT CONVERSION CACHED: " + elem)
+                        continue
+                elem_tasks = page_range_tasks(elem, page_count, per_task, page_dir)
+                if len(elem_tasks) == 0:
+                    atomic_write(elem[:-3] + "txt", "")
+                    write_page_log(elem, [])
+                    continue
+                pending[elem] = (len(elem_tasks), {})
+                tasks.extend(elem_tasks)
+
+            for pdf_name, first_page, text, records in pool.imap_unordered(ocr_page_range, tasks):
+                range_count, range_results = pending[pdf_name]
+                range_results[first_page] = (text, records)
+                if len(range_results) < range_count:
+                    continue
+
+                # All pages are done, so the pdf is assembled in page order and written out
+                del pending[pdf_name]
+                ordered_results = [range_results[first] for first in sorted(range_results)]
+                if any(text is None for text, records in ordered_results):
+                    print("TEXT CONVERSION FAILED: " + pdf_name)
+                    continue
+                write_pdf_text(pdf_name, (text for text, records in ordered_results))
+                write_page_log(pdf_name, [record for text, records in ordered_results for record in records])
+                if ocr_cache_dir is not None:
+                    ocr_cache.record_pdf(ocr_cache_dir, manifest, pdf_name, dict(entries.pop(pdf_name), status="done"))
+                print("TEXT CONVERSION DONE: " + pdf_name)
+    finally:
+        shutil.rmtree(run_temp_dir, ignore_errors=True)
 
 
 def main():
-    tesseract_pdf_reader([], "temp_image_file")
+    profile = load_ocr_profile(ocr_profile_file)
+    if profile is not None:
+        print("OCR PROFILE LOADED: " + str(profile))
+    if parallel_ocr:
+        parallel_tesseract_pdf_reader([])
+    else:
+        tesseract_pdf_reader([])
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@
 Authors: Matthew Ivler and Xanda Schofield
 Store passages as:
 original file of passage, passage text, list of Loughran words in passage, number of Loughran words (TSV)
+When several lexicons are searched at once, a fifth column lists the lexicons whose words are in the passage.
 
 Passage contains no new line characters or tabs
 If 2 Loughran words show up in the range, merge 2 passages (do not repeat overlap)
@@ -11,189 +12,310 @@ Word spread set to 20 in the main
 
 import codecs
 import os
+import shutil
 import sys
-import string
+import tempfile
+import time
+from collections import deque
+from multiprocessing import Pool
+from phrase_matcher import PhraseMatcher
+from tokenizer import normalize_word
 
 num_surrounding_words = 30
 
+# 0 prints nothing, 1 prints progress (passages/sec), 2 also prints every passage as it is written
+verbosity = 1
 
-def prior_update(running_list, new_word):
+# Characters of output held in memory before they are written to the tsv, and passages between progress reports
+flush_size = 1 << 22
+report_every = 10000
+
+# Per worker state of a parallel run (set by extraction_worker_init)
+worker_writer = None
+worker_lexicon = None
+worker_word_spread = None
+
+
+class PassageWriter:
     """
-    Modifies running word list to be up to date on latest 20 words
-    :param running_list: list - list of running words
-    :param new_word: string - new word added to running list
-    :return: Modified running list
+    Keeps the output tsv open for the whole run and writes passages to it in large blocks.
     """
-    running_list.pop(0)
-    running_list.append(new_word)
-    return running_list
 
-
-def word_process(word):
+    def __init__(self, outfile_name, buffer_size=flush_size):
+        """
+        :param outfile_name: str - name of outfile (cleared when opened)
+        :param buffer_size: int - characters of output buffered before a write
+        """
+        self.tsv = open(outfile_name, "w", encoding="utf-8")
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered_chars = 0
+        self.passage_count = 0
+        self.start = time.perf_counter()
+
+    def write(self, line):
+        """
+        Adds a line to the output
+        :param line: str - tsv line of a passage
+        :return: NONE
+        """
+        self.buffer.append(line)
+        self.buffered_chars += len(line)
+        self.passage_count += 1
+        if self.buffered_chars >= self.buffer_size:
+            self.flush()
+        if verbosity >= 1 and self.passage_count % report_every == 0:
+            self.report()
+
+    def flush(self):
+        self.tsv.write("".join(self.buffer))
+        self.buffer = []
+        self.buffered_chars = 0
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.passage_count / elapsed if elapsed > 0 else 0
+        print("{0} passages, {1:.1f} passages/sec".format(self.passage_count, rate))
+
+    def close(self):
+        self.flush()
+        self.tsv.close()
+        if verbosity >= 1:
+            self.report()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# format word (lowercase it get rid of ascii spec chars) so it can be compared to lexicon words (memoized, see tokenizer.py)
+word_process = normalize_word
+
+
+def load_lexicons(lexicon_file_names):
     """
-    format word (lowercase it get rid of ascii spec chars) so it can be compared to lexicon words
-    :param word: str - a word
-    :return: str - de-punctuated lowercase word
+    Compiles one or more lexicon files into a single matcher. Each lexicon is named after its file, and each line of
+    a file is a lexicon word or phrase (e.g. "line of credit").
+    :param lexicon_file_names: list - paths of lexicon files
+    :return: PhraseMatcher - matcher over all the lexicons
     """
-    lowered = word.lower()
-    return lowered.strip(string.punctuation).strip(string.whitespace)
+    lexicons = {}
+    for lexicon_file_name in lexicon_file_names:
+        name = os.path.splitext(os.path.basename(lexicon_file_name))[0]
+        with open(lexicon_file_name) as lex:
+            lexicons[name] = set((line.strip() for line in lex))
+    return PhraseMatcher(lexicons, word_process)
 
 
-def search_on(list_words, lexicon, current_word_index, word_spread):
+def extract_passages(words, lexicon, word_spread):
     """
-    Recursively build follow up passage after initial lexicon word sighting until there is a span of word_spread words
-    that do not fall within the lexicon.
-    :param list_words: list - all words in a doc (ordered)
-    :param lexicon: set - set of all words in desired lexicon
-    :param current_word_index: int - The spot in word list we are at (Note the current word is always a lexicon word)
+    Finds passages around lexicon words and phrases in one pass, without recursion or rescanning.
+    A passage is the word_spread words before a lexicon word (or phrase), the lexicon word, and the word_spread words
+    after it. Lexicon words up to 2 * word_spread words apart end up in the same passage (their passages would
+    overlap or touch), and the word_spread words after a passage are only used as the start of the next passage.
+    :param words: iterable - all words in a doc (ordered)
+    :param lexicon: PhraseMatcher - matcher over the desired lexicons (see load_lexicons)
     :param word_spread: int - the number of words we want around lexicon words
-    :return: tuple - (Words that follow, words from the lexicon later in the passage, number of words later)
+    :return: generator - (list of words in the passage, list of lexicon terms in the passage in order, list of the
+             lexicons those terms came from) per passage
     """
-    # Initialization
-    follow_up_list = []
-    lexicon_list = []
-    words_after_current = word_spread
-
-    # checks if near end of doc
-    if (current_word_index + word_spread) < len(list_words):
-        end = word_spread + 1
-    else:
-        end = len(list_words) - current_word_index
-        words_after_current = end
-
-    for i in range(1, end):
-
-        # Check if lexicon word is met
-        unprocessed_word = list_words[current_word_index + i]
+    # Last words seen while outside a passage (enough for word_spread words before the start of the longest phrase)
+    prior_words = deque(maxlen=word_spread + lexicon.max_length - 1)
+
+    # Open passage, its lexicon terms and lexicons, the index of its last lexicon word, and the words seen since
+    # that lexicon word
+    passage_words = None
+    lex_list = None
+    lexicon_names = None
+    last_lexicon_index = 0
+    pending_words = []
+    state = 0
+
+    for current_word, unprocessed_word in enumerate(words):
         word = word_process(unprocessed_word)
-
-        # Just add non-lexicon words
-        if word not in lexicon:
-            follow_up_list.append(unprocessed_word)
-
+        state, matches = lexicon.step(state, word)
+
+        # No lexicon word came within 2 * word_spread words, so the passage ends word_spread words after its last
+        # lexicon word and the words after that become the prior words of the next passage
+        if passage_words is not None and current_word - last_lexicon_index > 2 * word_spread:
+            passage_words.extend(pending_words[:word_spread])
+            yield passage_words, lex_list, lexicon_names
+            prior_words.extend(pending_words[word_spread:])
+            passage_words = None
+
+        if matches:
+            if passage_words is None:
+                # Keeps word_spread words before the first word of the longest phrase that ended here
+                phrase_length = max(match[2] for match in matches)
+                prior_count = min(len(prior_words), word_spread + phrase_length - 1)
+                passage_words = list(prior_words)[len(prior_words) - prior_count:]
+                lex_list = []
+                lexicon_names = []
+                prior_words.clear()
+            else:
+                passage_words.extend(pending_words)
+            passage_words.append(unprocessed_word)
+            for name, term, length in matches:
+                lex_list.append(term)
+                lexicon_names.append(name)
+            last_lexicon_index = current_word
+            pending_words = []
+        elif passage_words is not None:
+            pending_words.append(unprocessed_word)
         else:
-            follow_up_list.append(unprocessed_word)
-            lexicon_list.append(word)
-            recursed_tuple = search_on(list_words, lexicon, current_word_index + i, word_spread)
-            follow_up_list.extend(recursed_tuple[0])
-            lexicon_list.extend(recursed_tuple[1])
-            words_after_current = i + recursed_tuple[2]
-            break
-    return tuple([follow_up_list, lexicon_list, words_after_current])
+            prior_words.append(unprocessed_word)
+
+    # The doc ends inside a passage
+    if passage_words is not None:
+        passage_words.extend(pending_words[:word_spread])
+        yield passage_words, lex_list, lexicon_names
 
 
-def write_out(infile_name, outfile_name, passage_list, lex_words):
+def write_out(infile_name, writer, passage_list, lex_words, lexicon_names=None):
     """
     Writes info out to file
     :param infile_name: str - name of infile
-    :param outfile_name: str - name of outfile
+    :param writer: PassageWriter - writer of the outfile
     :param passage_list: list - list of strings to join into text passage
     :param lex_words: set - set of differing lexicon words that show up in passage
+    :param lexicon_names: set - set of lexicons the lexicon words came from, None to leave out the lexicon column
     :return: NONE
     """
-    with open(outfile_name, "a", encoding="utf-8") as tsv:
-        passage = ""
-        for word in passage_list:
-            processed_word = word.strip("\n\t")
-            if passage == "":
-                passage = processed_word
-            else:
-                passage = passage + " " + processed_word
+    passage = " ".join(word.strip("\n\t") for word in passage_list)
+    line = "{0}\t{1}\t{2}\t{3}".format(infile_name, passage, lex_words, len(lex_words))
+    if lexicon_names is not None:
+        line += "\t{0}".format(lexicon_names)
+    line += "\n"
+    if verbosity >= 2:
         print(infile_name)
         print(codecs.encode(infile_name, encoding="utf-8"))
         print(type(passage))
-        print("line: " + "{0}\t{1}\t{2}\t{3}\n".format(codecs.encode(infile_name, encoding="utf-8"), codecs.encode(passage, encoding="utf-8"), lex_words, len(lex_words)))
-        tsv.write("{0}\t{1}\t{2}\t{3}\n".format(infile_name, passage, lex_words, len(lex_words)))
+        print("line: " + str(codecs.encode(line, encoding="utf-8")))
+    writer.write(line)
 
 
-def file_parser(file_name, outfile_name, lexicon, word_spread):
+def file_parser(file_name, writer, lexicon, word_spread):
     """
     Gets passages, number of Loughran words, list of Loughran words from lexicon
     :param file_name: str - path and name of file
-    :param outfile_name: str - path and name of tsv to write to
-    :param lexicon: set - set of words in the lexicon
+    :param writer: PassageWriter - writer of the tsv to write to
+    :param lexicon: PhraseMatcher - matcher over the lexicons
     :param word_spread: int - number of words before and after lexicon word
     :return: NONE
     """
-    # Open file, initialize word list
-    list_words = []
+    # Only names the lexicons in the output when there is more than one to tell apart
+    several_lexicons = len(lexicon.lexicon_names) > 1
     with open(file_name, "r", encoding="utf-8") as infile:
-        # Create word list
-        for line in infile:
-            list_words.extend(line.split())
-
-    current_word = 0
-    passage_words = []
-    # Look at each element, lowercase it, get rid of ascii spec chars (word check)
-    # Track as first 20, check later 20, if nothing new in later 20, look at more
-    while current_word < len(list_words):
-        unprocessed_word = list_words[current_word]
-        word = word_process(unprocessed_word)
-        if word in lexicon:
-            passage_words.append(unprocessed_word)
-            text_tuple = search_on(list_words, lexicon, current_word, word_spread)
-            passage_words.extend(text_tuple[0])
-            lex_list = [word]
-            lex_list.extend(text_tuple[1])
-            current_word += text_tuple[2]
-
-            # Checks following text to see if there would be overlap of lexicon words, and merges what would be
-            # Two passages with slight overlap (ie 2 lexicon words 30 words away, but with a spread of 20 words would
-            # have a 10 word overlap, so instead the passages are merged)
-            follow_up_tuple = search_on(list_words, lexicon, current_word, word_spread)
-
-            # If following words do require merging, then merge and keep checking until no lexicon words are found
-            # in the potential overlap zone
-            while len(follow_up_tuple[1]) != 0:
-                # Builds up passage and lex list
-                passage_words.extend(follow_up_tuple[0])
-                lex_list.extend(follow_up_tuple[1])
-
-                # Update current word index to rerun check
-                current_word = current_word + follow_up_tuple[2]
-                follow_up_tuple = search_on(list_words, lexicon, current_word, word_spread)
-            # Appends new passage and details of passage to tsv
-            write_out(file_name, outfile_name, passage_words, set(lex_list))
-
-            # Prior words will always either be word_spread long (based on follow_up_tuple) or shorter (if end of doc)
-            current_word = current_word + follow_up_tuple[2]
-            passage_words = follow_up_tuple[0]
-
-        # Accounts for start of doc, building up prior words list until it is word_spread long
-        elif len(passage_words) < word_spread:
-            passage_words.append(unprocessed_word)
+        # Streams the words of the file into the passage finder, and appends each passage and its details to the tsv
+        words = (word for line in infile for word in line.split())
+        for passage_words, lex_list, lexicon_names in extract_passages(words, lexicon, word_spread):
+            write_out(file_name, writer, passage_words, set(lex_list), set(lexicon_names) if several_lexicons else None)
+
+
+def extraction_worker_init(lexicon, word_spread, shard_dir):
+    """
+    Sets up a pool worker of a parallel run with its own shard of the output
+    :param lexicon: PhraseMatcher - matcher over the lexicons
+    :param word_spread: int - number of words before and after lexicon word
+    :param shard_dir: str - directory the shards are written in
+    :return: NONE
+    """
+    global worker_writer, worker_lexicon, worker_word_spread
+    worker_lexicon = lexicon
+    worker_word_spread = word_spread
+    worker_writer = PassageWriter(os.path.join(shard_dir, "shard_" + str(os.getpid()) + ".tsv"))
 
-        # just keep going about, and keeping track of last word_spread words
-        else:
-            passage_words = prior_update(passage_words, unprocessed_word)
-        current_word += 1
+
+def parse_file_task(task):
+    """
+    Parses a file into the worker's shard
+    :param task: tuple - (int - position of the file in the run, str - path and name of file)
+    :return: tuple - (int - position of the file, str - shard path, int - byte where the file's passages start in
+             the shard, int - byte where they end)
+    """
+    file_index, file_name = task
+
+    # The shard is flushed around each file so the file's passages are a known stretch of bytes on disk
+    worker_writer.flush()
+    worker_writer.tsv.flush()
+    start = worker_writer.tsv.tell()
+    file_parser(file_name, worker_writer, worker_lexicon, worker_word_spread)
+    worker_writer.flush()
+    worker_writer.tsv.flush()
+    return file_index, worker_writer.tsv.name, start, worker_writer.tsv.tell()
+
+
+def parallel_extraction(file_names, outfile_name, lexicon, word_spread, processes):
+    """
+    Parses files across a pool of workers, each writing the passages it finds to its own shard, then merges the
+    shards into the outfile in the order of file_names. The outfile is byte for byte a serial run over the same files
+    under the same PYTHONHASHSEED (the lexicon word sets print in hash order, and forked workers share the parent's).
+    :param file_names: list - paths and names of the files, in output order
+    :param outfile_name: str - name of outfile
+    :param lexicon: PhraseMatcher - matcher over the lexicons
+    :param word_spread: int - number of words before and after lexicon word
+    :param processes: int - number of workers
+    :return: NONE
+    """
+    shard_dir = tempfile.mkdtemp(prefix="passage_shards_", dir=os.path.dirname(os.path.abspath(outfile_name)))
+    try:
+        pool = Pool(processes, initializer=extraction_worker_init, initargs=(lexicon, word_spread, shard_dir))
+        segments = [None] * len(file_names)
+        for file_index, shard_name, start, end in pool.imap_unordered(parse_file_task, enumerate(file_names)):
+            segments[file_index] = (shard_name, start, end)
+        pool.close()
+        pool.join()
+
+        # Copies each file's stretch of its shard into the outfile, in file order
+        shards = {}
+        with open(outfile_name, "wb") as tsv:
+            for shard_name, start, end in segments:
+                if shard_name not in shards:
+                    shards[shard_name] = open(shard_name, "rb")
+                shard = shards[shard_name]
+                shard.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    block = shard.read(min(remaining, flush_size))
+                    tsv.write(block)
+                    remaining -= len(block)
+        for shard in shards.values():
+            shard.close()
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
 
 
 def main():
     """
-    arg(1) - lexicon file (txt format and each line is a new lexicon word)
+    arg(1) - lexicon file (txt format and each line is a new lexicon word or phrase), or several comma separated files
     arg(2) - directory of files to process
     arg(3) - outfile (tsv)
+    arg(4) - (optional) number of worker processes, parses files in parallel
     :return:
     """
     # Get's arguments
-    lexicon_file_name = sys.argv[1]
+    lexicon_file_names = sys.argv[1].split(",")
     text_directory = sys.argv[2]
     outfile_name = sys.argv[3]
 
-    # Creates lexicon set
-    with open(lexicon_file_name) as lex:
-        lexicon = set((line.strip() for line in lex))
-
-    # Clears outfile
-    with open(outfile_name, "w", encoding="utf-8") as tsv:
-        pass
+    # Compiles the lexicons into one matcher
+    lexicon = load_lexicons(lexicon_file_names)
 
-    # Loop over files, parses them, and writes them out to outfile one passage at a time
+    file_names = []
     for root, dirs, files in os.walk(text_directory):
         for file in files:
-            file_name = root + "/" + file
-            file_parser(file_name, outfile_name, lexicon, num_surrounding_words)
+            file_names.append(root + "/" + file)
+
+    if len(sys.argv) > 4:
+        parallel_extraction(file_names, outfile_name, lexicon, num_surrounding_words, int(sys.argv[4]))
+        return
+
+    # Clears outfile, then loops over files, parses them, and writes them out to outfile (buffered)
+    with PassageWriter(outfile_name) as writer:
+        for file_name in file_names:
+            file_parser(file_name, writer, lexicon, num_surrounding_words)
 
 
 if __name__ == "__main__":
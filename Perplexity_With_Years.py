@@ -9,6 +9,7 @@ import pickle
 import sys
 import numpy as np
 import string
+from chunk_store import ChunkStoreReader
 
 
 # Set output files, directory of passages, and minimum document length
@@ -17,6 +18,10 @@ errors = "perplexity_errors.tsv"
 direct = "/home/CAMPUS/mnia2018/annual_reports_chunked/"
 min_doc_length = 20
 
+# Packed chunk store (see chunk_store.py) holding the passages instead of direct, None reads the files in direct
+chunk_store_dir = None
+chunk_store = ChunkStoreReader(chunk_store_dir) if chunk_store_dir is not None else None
+
 # In case of random stop, starts from this year and this doc
 start_year = 0
 end_year = 0
@@ -48,8 +53,11 @@ def get_perplex(file, model, error_file, timer):
     start = time.perf_counter()
     
     # Read file and tokenize
-    with open(file, "r", encoding="utf-8") as infile:
-        text = infile.read()
+    if chunk_store is not None:
+        text = chunk_store.get(file)
+    else:
+        with open(file, "r", encoding="utf-8") as infile:
+            text = infile.read()
     tokens = wordpunct_tokenize_no_nums_punct(text)
     grams = [tuple(tokens)]
 
@@ -90,7 +98,10 @@ def year_to_perplex(year):
     # Times process
     start = time.perf_counter()
     # Gets files, prints number of files in that year, loads model for that year
-    files = glob.glob(direct + "*" + str(year+1) + "*.txt")
+    if chunk_store is not None:
+        files = chunk_store.match("*" + str(year+1) + "*.txt")
+    else:
+        files = glob.glob(direct + "*" + str(year+1) + "*.txt")
     print("Num files:", year, len(files))
     lm_file = "surpriseModel" + str(year) + ".pkl"
     lm = load_model(lm_file)
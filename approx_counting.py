@@ -0,0 +1,95 @@
+"""
+Count-min sketch for finding frequent items in fixed memory, however many distinct items there are.
+A sketch never underestimates a count, and overestimates it by at most epsilon * (total count) with probability
+1 - delta, where epsilon = e / width and delta = e ** -depth. Items are added and queried as arrays of 64 bit hashes.
+"""
+import math
+import zlib
+import numpy as np
+
+
+class CountMinSketch:
+    """
+    depth rows of width counters; an item adds 1 to one counter per row and its estimate is the smallest of them.
+    Sketches with the same width, depth and seed can be merged by adding their counters.
+    """
+
+    def __init__(self, width, depth, seed=0, dtype=np.int64):
+        """
+        :param width: int- counters per row (error shrinks with width)
+        :param depth: int- number of rows (failure probability shrinks with depth)
+        :param seed: int- seed of the row hash functions (must match between sketches that are merged)
+        :param dtype: numpy type of the counters (np.uint32 keeps per batch sketches small)
+        """
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=dtype)
+        self.total = 0
+
+        # Multiply-shift hash of each row (odd multipliers)
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(1, 1 << 63, size=depth, dtype=np.uint64) | np.uint64(1)
+        self.offsets = rng.integers(0, 1 << 63, size=depth, dtype=np.uint64)
+
+    def _columns(self, row, hashes):
+        columns = ((hashes * self.multipliers[row] + self.offsets[row]) >> np.uint64(32)) % np.uint64(self.width)
+        return columns.astype(np.intp)
+
+    def add(self, hashes):
+        """
+        Counts items
+        :param hashes: np.ndarray- uint64 hashes of the items (one per occurrence)
+        :return: None
+        """
+        for row in range(self.depth):
+            self.table[row] += np.bincount(self._columns(row, hashes), minlength=self.width).astype(self.table.dtype)
+        self.total += len(hashes)
+
+    def query(self, hashes):
+        """
+        Estimates counts
+        :param hashes: np.ndarray- uint64 hashes of the items
+        :return: np.ndarray- estimated count of each item (never below its true count)
+        """
+        estimates = self.table[0][self._columns(0, hashes)]
+        for row in range(1, self.depth):
+            estimates = np.minimum(estimates, self.table[row][self._columns(row, hashes)])
+        return estimates
+
+    def update(self, other):
+        """
+        Adds the counts of another sketch (same width, depth and seed) to this one
+        :param other: CountMinSketch- sketch to merge in
+        :return: None
+        """
+        self.table += other.table
+        self.total += other.total
+
+    def error_bound(self):
+        """
+        :return: tuple- (float- most an estimate exceeds its true count by, float- probability it stays within that)
+        """
+        return math.e / self.width * self.total, 1 - math.exp(-self.depth)
+
+
+def int_hashes(keys):
+    """
+    :param keys: lst- non-negative int keys (below 2 ** 64)
+    :return: np.ndarray- the keys as uint64 hashes
+    """
+    return np.fromiter(keys, dtype=np.uint64, count=len(keys))
+
+
+def pair_hashes(pairs):
+    """
+    Hashes pairs of strings the same way in every process (unlike hash(), which is salted per interpreter)
+    :param pairs: lst- (str, str) tuples
+    :return: np.ndarray- uint64 hash of each pair (crc32 of the first string in the high half, of the second in the low)
+    """
+    token_hashes = {}
+    for pair in pairs:
+        for token in pair:
+            if token not in token_hashes:
+                token_hashes[token] = zlib.crc32(token.encode("utf-8"))
+    return np.fromiter(((token_hashes[first] << 32) | token_hashes[second] for first, second in pairs),
+                       dtype=np.uint64, count=len(pairs))
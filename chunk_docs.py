@@ -1,5 +1,15 @@
 import os
+import shutil
+import source_manifest
 import sys
+from multiprocessing import Pool
+
+# Manifest of the chunked files so reruns only chunk new or changed files. It is kept beside the output directory
+# (<output directory>_manifest.json, as doc_chunker_one_liner.py does) so the directory only holds chunks
+manifest_suffix = "_manifest.json"
+
+# Where earlier runs kept the manifest (inside the output directory), moved out on the next run
+old_manifest_name = "chunk_manifest.json"
 
 
 def chunker(root, file_name, num_words, output_path):
@@ -73,16 +83,93 @@ def chunker(root, file_name, num_words, output_path):
         file_out.close()
 
 
+def chunker_task(task):
+    """
+    Pool wrapper of chunker
+    :param task: tuple- (root, file_name, num_words, output_path) as passed to chunker
+    :return: str- path of the chunked file written
+    """
+    root, file_name, num_words, output_path = task
+    chunker(root, file_name, num_words, output_path)
+    return output_path + "/" + file_name[:-4] + "_out.txt"
+
+
+def parallel_chunker(root_files, num_words, output_path, merged_path, processes, to_process=None):
+    """
+    Chunks files across a pool of workers, then merges the chunked files into one TSV.
+    Each worker streams its chunks to its file's own chunked file (so holds at most one chunk of text), and the
+    merge appends the chunked files in sorted file order as soon as each is finished, so the merged TSV is the same
+    however the work was split.
+    :param root_files: list- (root, file name) of every text file, all of them end up in the merged TSV
+    :param num_words: int- number of words per chunk
+    :param output_path: str- path for chunked file directory
+    :param merged_path: str- path of the merged TSV
+    :param processes: int- number of workers
+    :param to_process: set- (root, file name) of the files that need chunking, None to chunk all of them (the others
+                       already have an up to date chunked file)
+    :return: None
+    """
+    root_files = sorted(root_files)
+    tasks = [(root, file, num_words, output_path) for root, file in root_files
+             if to_process is None or (root, file) in to_process]
+
+    pool = Pool(processes)
+    with open(merged_path, "w", encoding="utf8") as merged:
+        # imap hands back the results in task order, which keeps the merge deterministic
+        chunked_files = pool.imap(chunker_task, tasks)
+        for root, file in root_files:
+            if to_process is None or (root, file) in to_process:
+                chunked_file = next(chunked_files)
+            else:
+                chunked_file = output_path + "/" + file[:-4] + "_out.txt"
+            with open(chunked_file, "r", encoding="utf8") as chunked:
+                shutil.copyfileobj(chunked, merged)
+    pool.close()
+    pool.join()
+
+
 def main():
     # sys.argv[1] (str) path to directory with text files
     # sys.argv[2] (int) number of words per chunk
     # sys.argv[3] (str) path to directory for files to end up in
+    # sys.argv[4] (int, optional) number of workers, runs in parallel and merges all chunks into one TSV
+    # sys.argv[5] (str, optional) path of the merged TSV (defaults to the output directory's name + .tsv)
     path = sys.argv[1]
+    num_words = int(sys.argv[2])
+    output_path = sys.argv[3]
+
+    root_files = []
     for root, dirs, files in os.walk(path):
         for file in files:
-            chunker(root, file, int(sys.argv[2]), sys.argv[3])
+            root_files.append((root, file))
+
+    # Only files that are new or changed since the last run (with the same chunk size) are chunked again, and the
+    # chunked files of removed files are deleted
+    manifest_file = output_path.rstrip("/") + manifest_suffix
+    if os.path.exists(output_path + "/" + old_manifest_name) and not os.path.exists(manifest_file):
+        os.replace(output_path + "/" + old_manifest_name, manifest_file)
+    manifest = source_manifest.load_manifest(manifest_file)
+    params = {"num_words": num_words}
+    sources, removed, entries = source_manifest.plan_run(manifest, [root + "/" + file for root, file in root_files],
+                                                         params)
+    for source in removed:
+        chunked_file = output_path + "/" + source.rsplit("/", 1)[1][:-4] + "_out.txt"
+        if os.path.exists(chunked_file):
+            os.remove(chunked_file)
+    to_process = set(tuple(source.rsplit("/", 1)) for source in sources)
+    print("Chunking " + str(len(to_process)) + " of " + str(len(root_files)) + " files, " + str(len(removed)) +
+          " removed")
+
+    if len(sys.argv) > 4:
+        merged_path = sys.argv[5] if len(sys.argv) > 5 else output_path.rstrip("/") + ".tsv"
+        parallel_chunker(root_files, num_words, output_path, merged_path, int(sys.argv[4]), to_process)
+    else:
+        for root, file in root_files:
+            if (root, file) in to_process:
+                chunker(root, file, num_words, output_path)
+
+    source_manifest.save_manifest(manifest_file, {"params": params, "sources": entries})
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,243 @@
+"""
+Packed store for document chunks, used instead of writing every chunk to its own small text file.
+A store is a directory of shards. Each shard is a data file (<shard>.dat, chunk texts back to back in utf-8) and an
+index file (<shard>.idx) of binary records: time written (8 bytes), offset (8 bytes), length (4 bytes), id length
+(2 bytes), then the chunk id. Both files are only ever appended to, so separate processes can each write their own
+shard. The latest record for an id (across all shards) replaces earlier ones, and a record with length DELETED removes
+the chunk.
+Replaced and deleted chunks keep their space until the store is compacted (see compact).
+"""
+import fnmatch
+import glob
+import os
+import shutil
+import struct
+import time
+
+record_header = struct.Struct("<QQIH")
+DELETED = 0xFFFFFFFF
+
+# Index records a writer holds before flushing its data file and then writing them out, so an index record never
+# reaches the disk ahead of its data
+index_batch_size = 256
+
+
+class ChunkStoreWriter:
+    """
+    Appends chunks to one shard of a store. The shard's files are only made once something is written to it.
+    """
+
+    def __init__(self, store_dir, shard_name):
+        """
+        :param store_dir: str- directory of the store (made if missing)
+        :param shard_name: str- name of the shard to append to (one writing process per shard)
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.shard_name = shard_name
+        self.data_file = None
+        self.index_file = None
+        self.offset = 0
+        self.pending_records = []
+
+    def _open(self):
+        if self.data_file is None:
+            self.data_file = open(os.path.join(self.store_dir, self.shard_name + ".dat"), "ab")
+            self.index_file = open(os.path.join(self.store_dir, self.shard_name + ".idx"), "ab")
+            self.offset = self.data_file.tell()
+
+    def add(self, chunk_id, text):
+        """
+        Adds a chunk (replacing any chunk with the same id)
+        :param chunk_id: str- id of the chunk
+        :param text: str- text of the chunk
+        :return: None
+        """
+        self._open()
+        data = text.encode("utf-8")
+        encoded_id = chunk_id.encode("utf-8")
+        self.data_file.write(data)
+        self._add_record(record_header.pack(time.time_ns(), self.offset, len(data), len(encoded_id)) + encoded_id)
+        self.offset += len(data)
+
+    def delete(self, chunk_id):
+        """
+        Removes a chunk from the store
+        :param chunk_id: str- id of the chunk
+        :return: None
+        """
+        self._open()
+        encoded_id = chunk_id.encode("utf-8")
+        self._add_record(record_header.pack(time.time_ns(), 0, DELETED, len(encoded_id)) + encoded_id)
+
+    def _add_record(self, record):
+        self.pending_records.append(record)
+        if len(self.pending_records) >= index_batch_size:
+            self._flush_records()
+
+    def _flush_records(self):
+        # Data goes out before the index, so even after a crash an index record never points past the end of its data
+        # file
+        self.data_file.flush()
+        self.index_file.write(b"".join(self.pending_records))
+        self.index_file.flush()
+        self.pending_records = []
+
+    def close(self):
+        if self.data_file is not None:
+            self._flush_records()
+            self.data_file.close()
+            self.index_file.close()
+            self.data_file = None
+            self.index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ChunkStoreReader:
+    """
+    Random access (by chunk id) and sequential streaming over all shards of a store.
+    """
+
+    def __init__(self, store_dir):
+        """
+        :param store_dir: str- directory of the store
+        """
+        self.store_dir = store_dir
+        self.data_files = {}
+
+        # Gathers the latest record of every chunk id across the shards
+        latest = {}
+        for index_path in sorted(glob.glob(os.path.join(store_dir, "*.idx"))):
+            shard_name = os.path.basename(index_path)[:-4]
+            with open(index_path, "rb") as index_file:
+                index_data = index_file.read()
+            data_path = os.path.join(store_dir, shard_name + ".dat")
+            data_size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+            position = 0
+            while position + record_header.size <= len(index_data):
+                written, offset, length, id_length = record_header.unpack_from(index_data, position)
+                position += record_header.size
+                # Stops at a record cut short by a crash
+                if position + id_length > len(index_data):
+                    break
+                chunk_id = index_data[position:position + id_length].decode("utf-8")
+                position += id_length
+                # Skips a record whose data was lost in a crash
+                if length != DELETED and offset + length > data_size:
+                    continue
+                if chunk_id not in latest or latest[chunk_id][0] <= written:
+                    latest[chunk_id] = (written, shard_name, offset, length)
+
+        # chunk id to (shard name, offset, length), in the order chunks were written
+        self.index = {}
+        for written, shard_name, offset, length, chunk_id in sorted(record + (chunk_id,)
+                                                                    for chunk_id, record in latest.items()):
+            if length != DELETED:
+                self.index[chunk_id] = (shard_name, offset, length)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.index
+
+    def ids(self):
+        """
+        :return: lst- ids of all chunks in the store
+        """
+        return list(self.index)
+
+    def match(self, pattern):
+        """
+        Gets the ids of chunks matching a glob style pattern (what glob.glob used to find in the chunk directory)
+        :param pattern: str- pattern such as "*2017*.txt"
+        :return: lst- matching chunk ids
+        """
+        return [chunk_id for chunk_id in self.index if fnmatch.fnmatchcase(chunk_id, pattern)]
+
+    def _data_file(self, shard_name):
+        if shard_name not in self.data_files:
+            self.data_files[shard_name] = open(os.path.join(self.store_dir, shard_name + ".dat"), "rb")
+        return self.data_files[shard_name]
+
+    def get(self, chunk_id):
+        """
+        Reads a single chunk
+        :param chunk_id: str- id of the chunk
+        :return: str- text of the chunk
+        """
+        shard_name, offset, length = self.index[chunk_id]
+        data_file = self._data_file(shard_name)
+        data_file.seek(offset)
+        return data_file.read(length).decode("utf-8")
+
+    def iter_chunks(self, chunk_ids=None):
+        """
+        Streams chunks, reading each shard front to back
+        :param chunk_ids: iterable- ids of the chunks wanted, None for every chunk
+        :return: generator- (chunk id, text) tuples in shard and offset order
+        """
+        if chunk_ids is None:
+            chunk_ids = self.index
+        locations = sorted((self.index[chunk_id], chunk_id) for chunk_id in chunk_ids)
+        for (shard_name, offset, length), chunk_id in locations:
+            data_file = self._data_file(shard_name)
+            if data_file.tell() != offset:
+                data_file.seek(offset)
+            yield chunk_id, data_file.read(length).decode("utf-8")
+
+    def close(self):
+        for data_file in self.data_files.values():
+            data_file.close()
+        self.data_files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def compact(store_dir, max_shards=1, max_dead_ratio=0.0):
+    """
+    Rewrites the live chunks of a store into one new shard and removes the old shards, which reclaims the space of
+    replaced and deleted chunks and shrinks the index the reader scans. No process may write to the store meanwhile.
+    :param store_dir: str- directory of the store
+    :param max_shards: int- compacts if the store has more shards than this
+    :param max_dead_ratio: float- compacts if more than this fraction of the stored bytes belong to replaced or deleted
+                           chunks
+    :return: bool- True if the store was compacted
+    """
+    index_paths = sorted(glob.glob(os.path.join(store_dir, "*.idx")))
+    if len(index_paths) == 0:
+        return False
+    with ChunkStoreReader(store_dir) as reader:
+        live_bytes = sum(length for shard_name, offset, length in reader.index.values())
+        stored_bytes = sum(os.path.getsize(index_path[:-4] + ".dat") for index_path in index_paths
+                           if os.path.exists(index_path[:-4] + ".dat"))
+        if len(index_paths) <= max_shards and stored_bytes - live_bytes <= max_dead_ratio * stored_bytes:
+            return False
+
+        # The new shard is written outside the store, so a crash midway leaves the store as it was
+        shard_name = "compact_" + str(time.time_ns())
+        work_dir = os.path.join(store_dir, "compacting")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        with ChunkStoreWriter(work_dir, shard_name) as writer:
+            for chunk_id, text in reader.iter_chunks():
+                writer.add(chunk_id, text)
+
+    # Its records are newer than all the old ones, so the store reads the same even before the old shards are gone
+    if os.path.exists(os.path.join(work_dir, shard_name + ".dat")):
+        os.replace(os.path.join(work_dir, shard_name + ".dat"), os.path.join(store_dir, shard_name + ".dat"))
+        os.replace(os.path.join(work_dir, shard_name + ".idx"), os.path.join(store_dir, shard_name + ".idx"))
+    shutil.rmtree(work_dir, ignore_errors=True)
+    for index_path in index_paths:
+        os.remove(index_path)
+        if os.path.exists(index_path[:-4] + ".dat"):
+            os.remove(index_path[:-4] + ".dat")
+    return True
@@ -1,36 +1,97 @@
 import random
+from passage_index import PassageIndex, passage_source, passage_year
 
 
 infile = "risk_only_passages_uncleaned.tsv"
 outfile = "risk_only_passages.tsv"
-lines_in_file = 526548
 sample_size = 100
 
+# Seed of the sample (None for a different sample every run)
+random_seed = None
+
+# None samples sample_size passages from the whole file, "year" or "source" samples sample_size passages from each
+# year or each source file
+stratify_by = None
+
+# Samples through the sidecar index of infile (see passage_index.py, built on first use) instead of reading the whole
+# file, for repeated samples of the same file
+use_index = False
+
+
+def reservoir_sample(lines, size, rng, key=None):
+    """
+    Picks a uniform random sample of lines in one pass without knowing how many there are (reservoir sampling).
+    Line i replaces a random member of a full reservoir with probability size / (i + 1).
+    :param lines: iterable- lines to sample
+    :param size: int- number of lines to sample (from each stratum)
+    :param rng: random.Random- source of randomness
+    :param key: function- gives the stratum of a line, None to sample all lines together
+    :return: lst- (line number, line) of the sampled lines, in line order
+    """
+    # stratum to [number of its lines seen, its reservoir]
+    strata = {}
+    for line_num, line in enumerate(lines):
+        stratum = key(line) if key is not None else None
+        if stratum not in strata:
+            strata[stratum] = [0, []]
+        seen, reservoir = strata[stratum]
+        if seen < size:
+            reservoir.append((line_num, line))
+        else:
+            slot = rng.randint(0, seen)
+            if slot < size:
+                reservoir[slot] = (line_num, line)
+        strata[stratum][0] = seen + 1
+
+    sample = []
+    for seen, reservoir in strata.values():
+        sample.extend(reservoir)
+    return sorted(sample)
+
+
+def index_sample(index, size, rng, stratify_by=None):
+    """
+    Picks a uniform random sample of rows from an indexed passage tsv, reading only the sampled rows
+    :param index: PassageIndex- index of the tsv
+    :param size: int- number of rows to sample (from each stratum)
+    :param rng: random.Random- source of randomness
+    :param stratify_by: str- "year" or "source" to sample each stratum, None to sample all rows together
+    :return: lst- (line number, line) of the sampled lines, in line order
+    """
+    if stratify_by is None:
+        strata = [range(len(index))]
+    else:
+        strata = index.strata(stratify_by).values()
+    sample_rows = []
+    for rows in strata:
+        sample_rows.extend(rng.sample(rows, min(size, len(rows))))
+    sample_rows.sort()
+    return list(zip(sample_rows, index.rows(sample_rows)))
+
 
 def main():
-    # Chooses random line numbers to sample
-    line_lst = set([])
-    while len(line_lst) < sample_size:
-        line_num = random.randint(0, lines_in_file)
-        line_lst.add(line_num)
-    current_line = 0
-
-    # Opens file in and file out
-    with open(infile, "r", encoding="utf-8") as inf:
-        with open(outfile, "w", encoding="utf-8") as outf:
-            for line in inf:
-
-                # gets file name without path, and gets passage text
-                line_parts = line.split("\t")
-                file_path_parts = line_parts[0].split("/")
-                file_name = file_path_parts[len(file_path_parts) - 1]
-                passage = line_parts[1]
-
-                # Writes out both into out file if line is included in sample set
-                text_line = file_name + "\t" + passage + "\n"
-                if current_line in line_lst:
-                    outf.write(text_line)
-                current_line += 1
+    rng = random.Random(random_seed)
+    key = {None: None, "year": passage_year, "source": passage_source}[stratify_by]
+
+    # Samples the file in one read (or through its index), then opens file out
+    if use_index:
+        with PassageIndex(infile) as index:
+            sample = index_sample(index, sample_size, rng, stratify_by)
+    else:
+        with open(infile, "r", encoding="utf-8") as inf:
+            sample = reservoir_sample(inf, sample_size, rng, key)
+    with open(outfile, "w", encoding="utf-8") as outf:
+        for line_num, line in sample:
+
+            # gets file name without path, and gets passage text
+            line_parts = line.split("\t")
+            file_path_parts = line_parts[0].split("/")
+            file_name = file_path_parts[len(file_path_parts) - 1]
+            passage = line_parts[1]
+
+            # Writes out both into out file
+            text_line = file_name + "\t" + passage + "\n"
+            outf.write(text_line)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,68 @@
 import os
+import source_manifest
 import sys
 from multiprocessing import Pool
+from chunk_store import ChunkStoreWriter, compact
 
 output_path = "annual_reports_chunked"
 num_words = 300
 
+# Characters read from a file at a time, so memory per worker stays flat whatever the size of the file
+read_buffer_size = 1 << 16
+
+# Packed chunk store (see chunk_store.py) to write chunks into instead of one file per chunk in output_path,
+# None writes the per chunk files. Each worker process appends to its own shard of the store.
+chunk_store_dir = None
+
+# The store is compacted into a single shard after a run that leaves it with more shards than this, or with more
+# than this fraction of its bytes taken by replaced or removed chunks
+max_store_shards = 8
+max_store_dead_ratio = 0.5
+
+# Manifest of the chunked source files, so reruns only chunk new or changed sources
+manifest_file = "annual_reports_chunked_manifest.json"
+
+
+def stream_words(file_in, buffer_size=read_buffer_size):
+    """
+    Splits a file into words (same as file_in.read().split()) while only reading buffer_size characters at a time
+    :param file_in: file- text file open for reading
+    :param buffer_size: int- number of characters read at a time
+    :return: generator- the words of the file in order
+    """
+    partial_word = ""
+    while True:
+        buffer = file_in.read(buffer_size)
+        if not buffer:
+            break
+        text = partial_word + buffer
+        words = text.split()
+
+        # A buffer that does not end in whitespace may have cut its last word in two, so that word waits for the
+        # next buffer
+        if not text[-1].isspace():
+            partial_word = words.pop()
+        else:
+            partial_word = ""
+        yield from words
+    if partial_word:
+        yield partial_word
+
+
+def write_chunk(store, chunk_name, words):
+    """
+    Writes out a chunk, to the chunk store if there is one and to its own file in output_path otherwise
+    :param store: ChunkStoreWriter- store of the worker, None to write a file
+    :param chunk_name: str- name of the chunk (file name in output_path, chunk id in the store)
+    :param words: list- words of the chunk
+    :return: None
+    """
+    if store is not None:
+        store.add(chunk_name, " ".join(words))
+    else:
+        with open(output_path + "/" + chunk_name, "w", encoding="utf-8") as file_out:
+            file_out.write(" ".join(words))
+
 def chunker(root_file):
     """
     Creates a chunked version of a text file where the new file is composed of several parts, each part being
@@ -13,33 +71,53 @@ def chunker(root_file):
     :param file_name: str- name of file being chunked
     :param num_words: int- number of words per chunk
     :param output_path: str- path for chunked file directory
-    :return: None
+    :return: int- number of chunks written
     """
     root = root_file[0]
     file_name = root_file[1]
+    store = ChunkStoreWriter(chunk_store_dir, "shard_" + str(os.getpid())) if chunk_store_dir is not None else None
 
     # Opens file to be read
     with open(root + "/" + file_name, "r", encoding="utf8") as file_in:
         # Sets text and initializes variables to be updated
-        line = file_in.read().split()
         text_to_write = []
         section_num = 1
         word_count = 0
-        for elem in line:
+        for elem in stream_words(file_in):
             word_count += 1
             text_to_write.append(elem)
             if word_count >= num_words:
-                outfile_name = output_path + "/" + file_name[:-4] + "_" +  str(section_num) + "_out.txt"
-                with open(outfile_name, "w", encoding="utf-8") as file_out:
-                    file_out.write(" ".join(text_to_write))
+                write_chunk(store, file_name[:-4] + "_" + str(section_num) + "_out.txt", text_to_write)
                 word_count = 0
                 text_to_write = []
                 section_num += 1
                 
         if len(text_to_write) > 0:
-            outfile_name = output_path + "/" + file_name[:-4] + "_" + str(section_num) + "_out.txt"
-            with open(outfile_name, "w", encoding="utf-8") as file_out:
-                file_out.write(" ".join(text_to_write))
+            write_chunk(store, file_name[:-4] + "_" + str(section_num) + "_out.txt", text_to_write)
+        else:
+            section_num -= 1
+
+    if store is not None:
+        store.close()
+    return section_num
+
+
+def remove_chunks(chunk_names):
+    """
+    Deletes chunks that no longer have a source (from the store if there is one, from output_path otherwise)
+    :param chunk_names: list- names of the chunks
+    :return: None
+    """
+    if len(chunk_names) == 0:
+        return
+    if chunk_store_dir is not None:
+        with ChunkStoreWriter(chunk_store_dir, "shard_" + str(os.getpid())) as store:
+            for chunk_name in chunk_names:
+                store.delete(chunk_name)
+    else:
+        for chunk_name in chunk_names:
+            if os.path.exists(output_path + "/" + chunk_name):
+                os.remove(output_path + "/" + chunk_name)
 
 
 def main():
@@ -52,11 +130,38 @@ def main():
         for file in files:
             tupe = (root, file)
             root_files.append(tupe)
+
+    # Only chunks sources that are new or changed since the last run with the same settings
+    manifest = source_manifest.load_manifest(manifest_file)
+    params = {"num_words": num_words, "chunk_store_dir": chunk_store_dir}
+    sources, removed, entries = source_manifest.plan_run(manifest, [root + "/" + file for root, file in root_files],
+                                                         params)
+    print("Chunking " + str(len(sources)) + " of " + str(len(root_files)) + " files, " + str(len(removed)) +
+          " removed")
+
     pool = Pool(35)
-    pool.map(chunker, root_files)
+    chunk_counts = pool.map(chunker, [tuple(source.rsplit("/", 1)) for source in sources])
     pool.close()
     pool.join()
 
+    # Removes the chunks of removed sources, and the chunks past the new end of sources that got shorter
+    stale_chunks = []
+    for source in removed:
+        file_name = source.rsplit("/", 1)[1]
+        for section_num in range(1, manifest["sources"][source].get("chunks", 0) + 1):
+            stale_chunks.append(file_name[:-4] + "_" + str(section_num) + "_out.txt")
+    for source, chunk_count in zip(sources, chunk_counts):
+        file_name = source.rsplit("/", 1)[1]
+        for section_num in range(chunk_count + 1, entries[source].get("chunks", 0) + 1):
+            stale_chunks.append(file_name[:-4] + "_" + str(section_num) + "_out.txt")
+        entries[source]["chunks"] = chunk_count
+    remove_chunks(stale_chunks)
+    if chunk_store_dir is not None and (len(sources) > 0 or len(stale_chunks) > 0):
+        if compact(chunk_store_dir, max_store_shards, max_store_dead_ratio):
+            print("Compacted " + chunk_store_dir)
+
+    source_manifest.save_manifest(manifest_file, {"params": params, "sources": entries})
+
 
 if __name__ == "__main__":
     main()
@@ -7,6 +7,8 @@ based on the .keys.txt mallet output.
 """
 
 import heapq
+import os
+from chunk_store import ChunkStoreReader
 
 # Important variables at the top for easy changes
 num_topics = 50
@@ -14,6 +16,10 @@ num_top_docs = 10
 doctopics_filename = "AR_tesseract_4.doctopics.tsv"
 output_filename = "best_docs_per_topic_4.tsv"
 
+# Packed chunk store (see chunk_store.py) to read passages from (by file name) instead of opening each file,
+# None opens the files
+chunk_store_dir = None
+
 
 def main():
     # Initializes heap
@@ -49,6 +55,8 @@ def main():
             for topic, neg_val in enumerate(negative_topic_vals):
                 heapq.heappushpop(heap_list[topic], (neg_val, line_filename))
 
+    store = ChunkStoreReader(chunk_store_dir) if chunk_store_dir is not None else None
+
     # Writes out the lines as:
     # topic number, file_name, proportion of doc (from doctopics file), and the passage from the file
     with open(output_filename, "w", encoding="utf-8") as outfile:
@@ -59,10 +67,13 @@ def main():
             # Actual writing
             for neg_value, filename in heap_list[i]:
                 filename_cut = filename[5:]
-                with open(filename_cut, "r", encoding="utf-8") as infile:
-                    passage = " ".join(infile.read().split())
-                    out_line = "{0}\t{1}\t{2}\t{3}\n".format(i, filename_cut, neg_value, passage)
-                    outfile.write(out_line)
+                if store is not None:
+                    passage = " ".join(store.get(os.path.basename(filename_cut)).split())
+                else:
+                    with open(filename_cut, "r", encoding="utf-8") as infile:
+                        passage = " ".join(infile.read().split())
+                out_line = "{0}\t{1}\t{2}\t{3}\n".format(i, filename_cut, neg_value, passage)
+                outfile.write(out_line)
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ and the vector of that term.
 """
 import glob
 import numpy as np
+from chunk_store import ChunkStoreReader
 from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.decomposition import TruncatedSVD
@@ -18,17 +19,24 @@ svd_outfile = "svd_post_matrix.tsv"
 path = "annual_reports_chunked/*.txt"
 file_list = glob.glob(path)
 
+# Packed chunk store (see chunk_store.py) to read the chunks from instead of the files above, None reads the files
+chunk_store_dir = None
+
 
 def matrix_maker():
     """
     Creates a sparse matrix from the documents provided
     :return: tuple- (a sparse matrix representation of the corpus, vocab of matrix, features of matrix)
     """
-    # Gets text from all documents
-    doc_passages = []
-    for file in file_list:
-        with open(file, encoding="utf-8") as f:
-            doc_passages.append(f.read())
+    # Gets text from all documents (streamed straight from the store if there is one)
+    if chunk_store_dir is not None:
+        store = ChunkStoreReader(chunk_store_dir)
+        doc_passages = (text for chunk_id, text in store.iter_chunks())
+    else:
+        doc_passages = []
+        for file in file_list:
+            with open(file, encoding="utf-8") as f:
+                doc_passages.append(f.read())
 
     # Creates vectorizer, and limits features to get rid of misreadings
     vectorizer = TfidfVectorizer(max_features=100000)
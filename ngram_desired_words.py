@@ -1,9 +1,11 @@
-import regex
 import csv
+import threading
 from multiprocessing import Pool
 import numpy as np
 import matplotlib.pyplot as plt
 import nltk
+from phrase_matcher import PhraseJoiner
+from tokenizer import lower_tokens
 
 
 # TSV file whose passages (the second portion of each line) are being ngrammed
@@ -12,6 +14,13 @@ input_file = "Loughran_Passages.tsv"
 # Output file as tsv
 outfile_name = "ngrammed_risk_passages.tsv"
 
+# Worker processes, and lines sent to a worker at a time
+processes = 30
+chunk_size = 64
+
+# Chunks per worker read ahead of the writer (bounds memory whatever the size of the input)
+chunks_in_flight = 4
+
 # List bank
 cash_words = ["cash", "cash_flow", "cash_reserves", "liquidity", "currency", "operating_cash_flow"]
 borrowing_words = ["borrowing", "loan", "loans", "line_of_credit", "lines_of_credit", "credit", "trade_credit",
@@ -27,43 +36,8 @@ all_words = []
 for lst in all_lists:
     all_words.extend(lst)
 
-
-def grammer_former(gram_size, upper_token_list):
-    """
-    creates a list of ngrammed tokens from a list of tokens
-    :param gram_size: int- the size of the ngrams desired
-    :param upper_token_list: list - list of tokens (not yet processed to be lowercase
-    :return: list- a list of now ngrammed tokens
-    """
-
-    # Processing tokens, and prepping a set of previous words
-    token_list = [token.lower() for token in upper_token_list]
-    prior_words = token_list[0:(gram_size - 1)]
-
-    # Adds first tokens to the updated_tokens
-    updated_tokens = [token_list[i] for i in range(0, gram_size - 1)]
-
-    # Goes through the rest of the tokens
-    for token in token_list[gram_size:]:
-
-        # creates ngram of prior words and new token
-        prior_words.append(token)
-        gram = "_".join(prior_words)
-
-        # Adds ngrammed word to updated tokens and gets rid of the words that were in updated_tokens that are now in the ngram
-        if gram in all_words:
-            for i in range(0,gram_size-1):
-                updated_tokens.pop()
-            updated_tokens.append(gram)
-
-        # Adds non-ngrammed token to updated_tokens
-        else:
-            updated_tokens.append(token)
-
-        # gets rid of first word in prior words to keep prior words at desired length in a queue
-        prior_words.pop(0)
-
-    return updated_tokens
+# Trie of all the phrases, joins phrases of any length in one pass
+phrase_joiner = PhraseJoiner(all_words)
 
 
 def process_line(line):
@@ -81,14 +55,13 @@ def process_line(line):
     text = line_parts[1]
 
     # tokenizes passage
-    tokens = regex.findall(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*", text)
+    tokens = lower_tokens(text)
 
-    # Creates trigrammed and bigrammed tokens
-    trigrammed_tokens = grammer_former(3, tokens)
-    bigrammed_trigrammed_tokens = grammer_former(2, trigrammed_tokens)
+    # Joins the phrases of the desired word lists (longest first)
+    ngrammed_tokens = phrase_joiner.join(tokens)
 
-    # puts together bigrammed and trigrammed text
-    ngrammed_text = " ".join(bigrammed_trigrammed_tokens)
+    # puts together ngrammed text
+    ngrammed_text = " ".join(ngrammed_tokens)
 
     # formats new line
     new_line = "{}\t{}\t{}\n".format(line_parts[0], year, ngrammed_text)
@@ -96,22 +69,31 @@ def process_line(line):
     return new_line
 
 
+def read_ahead(lines, slots):
+    """
+    Passes lines on to the pool, waiting for a free slot before each one (the writer frees a slot per line written),
+    since the pool would otherwise read the whole file in ahead of the workers
+    :param lines: iterable- lines of the input tsv
+    :param slots: threading.Semaphore- lines allowed between being read and being written
+    :return: generator- the lines
+    """
+    for line in lines:
+        slots.acquire()
+        yield line
+
+
 def main():
-    # reading in file
-    with open(input_file, "r", encoding="utf-8") as passages:
-        line_list = [line for line in passages]
+    slots = threading.Semaphore(processes * chunk_size * chunks_in_flight)
 
-    # Runs efficiant execution of line processing
-    processing_pool = Pool(30)
-    new_lines = processing_pool.map(process_line, line_list)
+    # Streams the passages through the pool, writing out each new line (ngrammed and reformatted) in input order as
+    # soon as it is done
+    processing_pool = Pool(processes)
+    with open(input_file, "r", encoding="utf-8") as passages, open(outfile_name, "w", encoding="utf-8") as outf:
+        for line in processing_pool.imap(process_line, read_ahead(passages, slots), chunksize=chunk_size):
+            outf.write(line)
+            slots.release()
     processing_pool.close()
     processing_pool.join()
-    del line_list
-
-    # writes out new passages and format (ngrammed and reformatted)
-    with open(outfile_name, "w", encoding="utf-8") as outf:
-        for line in new_lines:
-            outf.write(line)
 
 
 if __name__ == "__main__":
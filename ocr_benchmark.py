@@ -0,0 +1,160 @@
+"""
+Benchmarks OCR render resolutions and preprocessing steps on a random sample of pdf pages. Every setting is timed
+(pages/sec) and its text is compared against a reference setting (character agreement). The fastest setting that still
+agrees closely enough with the reference is written out as the profile PDFtoTextTester2.py uses for production runs.
+"""
+import bisect
+import difflib
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import pytesseract as tess
+from pdf2image import pdfinfo_from_path
+import PDFtoTextTester2 as ocr
+
+# Sample of pages to benchmark on
+sample_size = 40
+seed = 0
+
+# Settings being compared, every combination is tried
+dpis = [100, 150, 200, 300]
+grayscale_options = [False, True]
+binarize_options = [None, 160]
+image_formats = [None, "JPEG", "PNG"]
+
+# Setting the others are compared against, and how close they have to be to it to be recommended
+reference = (300, False, None, None)
+min_agreement = 0.97
+
+results_file = "ocr_benchmark.tsv"
+
+
+def sample_pages(pdf_list, num_pages, rng):
+    """
+    Draws pages uniformly at random from all pages of the given pdfs.
+    :param pdf_list: lst- paths to pdfs
+    :param num_pages: int- number of pages to draw
+    :param rng: random.Random- seeded random number generator
+    :return: lst- (pdf path, page number) tuples
+    """
+    # Running page totals so a page index over the whole sample can be mapped back to its pdf
+    totals = []
+    total = 0
+    for pdf_name in pdf_list:
+        total += pdfinfo_from_path(pdf_name)["Pages"]
+        totals.append(total)
+
+    pages = []
+    for index in sorted(rng.sample(range(total), min(num_pages, total))):
+        pdf_index = bisect.bisect_right(totals, index)
+        first_index = totals[pdf_index - 1] if pdf_index > 0 else 0
+        pages.append((pdf_list[pdf_index], index - first_index + 1))
+    return pages
+
+
+def agreement(reference_text, text):
+    """
+    Character agreement between two OCR outputs of the same page: the share of characters in matching (word aligned)
+    stretches of the two texts, 1.0 when they are the same.
+    :param reference_text: str- text from the reference setting
+    :param text: str- text from the setting being checked
+    :return: float- agreement from 0 to 1
+    """
+    reference_words = reference_text.split()
+    words = text.split()
+    total_chars = sum(len(word) for word in reference_words) + sum(len(word) for word in words)
+    if total_chars == 0:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, reference_words, words, autojunk=False)
+    matched_chars = sum(len(word) for block in matcher.get_matching_blocks()
+                        for word in reference_words[block.a:block.a + block.size])
+    return 2 * matched_chars / total_chars
+
+
+def benchmark(pages):
+    """
+    OCRs every sampled page under every setting.
+    :param pages: lst- (pdf path, page number) tuples
+    :return: dict- setting (dpi, grayscale, binarize threshold, image format) to (lst- page texts, float- seconds)
+    """
+    results = {}
+    for dpi, grayscale in itertools.product(dpis, grayscale_options):
+        preprocessing = list(itertools.product(binarize_options, image_formats))
+        for setting in preprocessing:
+            results[(dpi, grayscale) + setting] = ([], 0.0)
+
+        # Each page is rendered once per resolution/color mode and shared by the preprocessing options
+        for pdf_name, page_number in pages:
+            for _, page, render_ms in ocr.render_pages(pdf_name, page_number, page_number, 1, dpi, grayscale):
+                for binarize_threshold, image_format in preprocessing:
+                    start = time.perf_counter()
+                    text = tess.image_to_string(ocr.prepare_page(page, binarize_threshold, image_format))
+                    seconds = time.perf_counter() - start + render_ms / 1000
+
+                    texts, total_seconds = results[(dpi, grayscale, binarize_threshold, image_format)]
+                    texts.append(text)
+                    results[(dpi, grayscale, binarize_threshold, image_format)] = (texts, total_seconds + seconds)
+        print("BENCHMARKED: dpi " + str(dpi) + " grayscale " + str(grayscale))
+    return results
+
+
+def score(results):
+    """
+    Gets the speed and agreement with the reference of every setting.
+    :param results: dict- output of benchmark
+    :return: lst- (setting, float- pages/sec, float- mean agreement) tuples, fastest first
+    """
+    reference_texts = results[reference][0]
+    if len(reference_texts) == 0:
+        raise ValueError("No pdf pages were benchmarked, the directory has no pdfs with pages")
+    scores = []
+    for setting, (texts, seconds) in results.items():
+        pages_per_sec = len(texts) / seconds if seconds > 0 else 0
+        mean_agreement = sum(agreement(ref, text) for ref, text in zip(reference_texts, texts)) / len(texts)
+        scores.append((setting, pages_per_sec, mean_agreement))
+    return sorted(scores, key=lambda x: x[1], reverse=True)
+
+
+def write_results(scores):
+    """
+    Writes the benchmark table, and the recommended profile (fastest setting with enough agreement) for
+    PDFtoTextTester2.py.
+    :param scores: lst- output of score
+    :return: dict- the recommended profile
+    """
+    with open(results_file, "w", encoding="utf-8") as outf:
+        outf.write("dpi\tgrayscale\tbinarize_threshold\timage_format\tpages_per_sec\tagreement\n")
+        for setting, pages_per_sec, mean_agreement in scores:
+            outf.write("{0}\t{1}\t{2}\t{3}\t{4:.3f}\t{5:.4f}\n".format(*setting, pages_per_sec, mean_agreement))
+
+    recommended = next(x for x in scores if x[2] >= min_agreement or x[0] == reference)
+    setting, pages_per_sec, mean_agreement = recommended
+    profile = {"dpi": setting[0], "grayscale": setting[1], "binarize_threshold": setting[2],
+               "image_format": setting[3], "pages_per_sec": pages_per_sec, "agreement": mean_agreement}
+    with open(ocr.ocr_profile_file, "w", encoding="utf-8") as outf:
+        json.dump(profile, outf, indent=2)
+    return profile
+
+
+def main():
+    # sys.argv[1] (str) path to directory with pdfs to sample pages from
+    pdf_list = []
+    for root, dirs, files in os.walk(sys.argv[1]):
+        for file in files:
+            if file.lower().endswith(".pdf"):
+                pdf_list.append(root + "/" + file)
+
+    # Runs tesseract under the same thread cap as the production pool
+    os.environ["OMP_THREAD_LIMIT"] = str(ocr.tesseract_threads)
+    tess.pytesseract.tesseract_cmd = ocr.tesseract_path
+
+    pages = sample_pages(sorted(pdf_list), sample_size, random.Random(seed))
+    profile = write_results(score(benchmark(pages)))
+    print("RECOMMENDED PROFILE: " + str(profile))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Content addressed cache for OCR output. Page texts are stored under the hash of the pdf's contents, the OCR
+settings used, and the page number, so a crashed run resumes where it stopped and a re-downloaded (unchanged) pdf is
+never OCRed twice. A manifest keeps the hash of every pdf seen (so unchanged pdfs are not rehashed) and which pdfs
+were finished under which settings.
+"""
+import hashlib
+import json
+import os
+
+manifest_name = "manifest.tsv"
+hash_block_size = 1 << 20
+
+
+def file_hash(file_name):
+    """
+    Hashes the contents of a file in blocks.
+    :param file_name: str- path to the file
+    :return: str- sha256 hex digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(hash_block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def settings_key(settings):
+    """
+    Turns a dictionary of OCR settings into a short key, any change of setting gives a new key.
+    :param settings: dict- setting name to (json serializable) value
+    :return: str- key for the settings
+    """
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_manifest(cache_dir):
+    """
+    Reads the manifest of a cache (later lines replace earlier lines for the same pdf).
+    :param cache_dir: str- cache directory
+    :return: dict- pdf path to dict with keys size, mtime, hash, settings, status
+    """
+    manifest = {}
+    manifest_path = os.path.join(cache_dir, manifest_name)
+    if not os.path.exists(manifest_path):
+        return manifest
+    with open(manifest_path, "r", encoding="utf-8") as inf:
+        for line in inf:
+            parts = line.rstrip("\n").split("\t")
+            # Skips a line cut short by a crash
+            if len(parts) != 6:
+                continue
+            manifest[parts[0]] = {"size": int(parts[1]), "mtime": int(parts[2]), "hash": parts[3],
+                                  "settings": parts[4], "status": parts[5]}
+    return manifest
+
+
+def record_pdf(cache_dir, manifest, pdf_name, entry):
+    """
+    Updates the manifest entry of a pdf in memory and on disk (the manifest file is only ever appended to).
+    :param cache_dir: str- cache directory
+    :param manifest: dict- manifest loaded with load_manifest
+    :param pdf_name: str- path to the pdf
+    :param entry: dict- manifest entry (see load_manifest)
+    :return: None
+    """
+    manifest[pdf_name] = entry
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, manifest_name), "a", encoding="utf-8") as outf:
+        outf.write("{0}\t{1}\t{2}\t{3}\t{4}\t{5}\n".format(pdf_name, entry["size"], entry["mtime"], entry["hash"],
+                                                           entry["settings"], entry["status"]))
+
+
+def pdf_entry(manifest, pdf_name, settings):
+    """
+    Builds the manifest entry of a pdf for the current run, reusing the known hash if the file has not changed size
+    or modification time since it was last hashed.
+    :param manifest: dict- manifest loaded with load_manifest
+    :param pdf_name: str- path to the pdf
+    :param settings: str- settings key of the current run
+    :return: dict- manifest entry with status "pending", or the stored entry if it is already "done" for the same
+             contents and settings
+    """
+    stat = os.stat(pdf_name)
+    known = manifest.get(pdf_name)
+    if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime_ns:
+        if known["settings"] == settings and known["status"] == "done":
+            return known
+        pdf_digest = known["hash"]
+    else:
+        pdf_digest = file_hash(pdf_name)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": pdf_digest, "settings": settings,
+            "status": "pending"}
+
+
+def page_cache_path(cache_dir, pdf_digest, settings):
+    """
+    Gets the directory holding the cached pages of one pdf under one set of settings.
+    :param cache_dir: str- cache directory
+    :param pdf_digest: str- hash of the pdf's contents
+    :param settings: str- settings key
+    :return: str- path of the page directory
+    """
+    return os.path.join(cache_dir, "pages", pdf_digest[:2], pdf_digest, settings)
+
+
+def load_cached_page(page_dir, page_number):
+    """
+    Gets a page from the cache.
+    :param page_dir: str- page directory (see page_cache_path)
+    :param page_number: int- page number
+    :return: tuple- (str- page text, str- path used to get the text) or None if the page is not cached
+    """
+    try:
+        with open(os.path.join(page_dir, str(page_number) + ".txt"), "r", encoding="utf-8", newline="") as inf:
+            source = inf.readline().rstrip("\n")
+            return inf.read(), source
+    except FileNotFoundError:
+        return None
+
+
+def store_cached_page(page_dir, page_number, text, source):
+    """
+    Stores a page in the cache (atomically, so an interrupted write never leaves a partial page behind).
+    :param page_dir: str- page directory (see page_cache_path)
+    :param page_number: int- page number
+    :param text: str- page text
+    :param source: str- path used to get the text
+    :return: None
+    """
+    os.makedirs(page_dir, exist_ok=True)
+    page_file = os.path.join(page_dir, str(page_number) + ".txt")
+    temp_file = page_file + "." + str(os.getpid()) + ".tmp"
+    with open(temp_file, "w", encoding="utf-8", newline="") as outf:
+        outf.write(source + "\n" + text)
+    os.replace(temp_file, page_file)
@@ -1,28 +1,101 @@
 """
 Author: Matthew Ivler
-Takes a file of ngrams and their counts, then puts them in order for easier diagnosis on what a good count cutoff is.
+Takes a file of ngrams and their counts, then summarizes them for easier diagnosis on what a good count cutoff is.
+Reads the file once, keeping only a log binned histogram of counts, the top_k ngrams, and the number of ngrams at or
+above each candidate threshold.
 """
+import bisect
+import heapq
+import math
+
 filename = "trigrams_count.txt"
 fileout = "trigrams_count_ordered.txt"
 threshold = 100
 
+# Candidate cutoffs to count survivors for, number of most frequent ngrams to list, and histogram bins per power of 10
+thresholds = [threshold, 1000, 10000, 24000]
+top_k = 50
+bins_per_decade = 4
+
+# Also writes every ngram to fileout in count order (needs the whole file in memory, as the old full sort did)
+write_ordered = False
+
+
+def analyze(lines, candidate_thresholds, k, decade_bins):
+    """
+    Summarizes ngram counts in one pass
+    :param lines: iterable- lines of "ngram count"
+    :param candidate_thresholds: lst- cutoffs to count survivors for
+    :param k: int- number of most frequent ngrams to keep
+    :param decade_bins: int- histogram bins per power of 10
+    :return: tuple- (int- number of ngrams, dict- histogram bin to number of ngrams (bin b holds counts from
+             10 ** (b / decade_bins) up to the next bin), lst- (count, ngram) of the top k (most frequent first),
+             lst- (threshold, number of ngrams with at least that count))
+    """
+    cutoffs = sorted(candidate_thresholds)
+    above = [0] * (len(cutoffs) + 1)
+    histogram = {}
+    top = []
+    total = 0
+    for line in lines:
+        line_split = line.split()
+        if len(line_split) < 2:
+            continue
+        gram = line_split[0]
+        count = int(line_split[1])
+        total += 1
+
+        # Counts below 1 share the lowest bin
+        histogram_bin = int(math.floor(math.log10(count) * decade_bins)) if count >= 1 else -1
+        histogram[histogram_bin] = histogram.get(histogram_bin, 0) + 1
+
+        # Number of cutoffs this ngram passes
+        above[bisect.bisect_right(cutoffs, count)] += 1
+
+        if len(top) < k:
+            heapq.heappush(top, (count, gram))
+        elif count > top[0][0]:
+            heapq.heappushpop(top, (count, gram))
+
+    # An ngram passing i cutoffs survives the first i of them
+    survivors = []
+    passing = 0
+    for i in range(len(cutoffs), 0, -1):
+        passing += above[i]
+        survivors.append((cutoffs[i - 1], passing))
+    survivors.reverse()
+    return total, histogram, sorted(top, reverse=True), survivors
+
 
 def main():
-    # Initialize dictionary {key = word : value = count}
-    unordered_dict = {}
-    
-    # Creates ordered version of dictionary based
     with open(filename, "r", encoding="utf-8") as inf:
-        for line in inf:
-            line_split = line.split()
-            unordered_dict[line_split[0]] = line_split[1]
-    ordered_dict = {k:v for k, v in sorted(unordered_dict.items(), key=lambda x: int(x[1]))}
-    
-    # Writes ordered dictionary to outfile
-    with open(fileout, "w", encoding="utf-8") as outf:
-        for word, count in ordered_dict.items():
-            line = word + " " + count + "\n"
-            outf.write(line)
+        total, histogram, top, survivors = analyze(inf, thresholds, top_k, bins_per_decade)
+
+    report = [str(total) + " ngrams", "", "count >= threshold:"]
+    for cutoff, passing in survivors:
+        report.append("{0}\t{1}".format(cutoff, passing))
+    report.extend(["", "histogram (count range: ngrams):"])
+    for histogram_bin in sorted(histogram):
+        if histogram_bin < 0:
+            report.append("< 1: {0}".format(histogram[histogram_bin]))
+        else:
+            low = math.ceil(10 ** (histogram_bin / bins_per_decade))
+            high = math.ceil(10 ** ((histogram_bin + 1) / bins_per_decade))
+            report.append("{0} - {1}: {2}".format(low, high - 1, histogram[histogram_bin]))
+    report.extend(["", "top " + str(top_k) + ":"])
+    for count, gram in top:
+        report.append(gram + " " + str(count))
+    print("\n".join(report))
+
+    # Writes ordered ngrams to outfile
+    if write_ordered:
+        with open(filename, "r", encoding="utf-8") as inf:
+            counts = [(int(line.split()[1]), line.split()[0]) for line in inf if len(line.split()) >= 2]
+        counts.sort(key=lambda x: x[0])
+        with open(fileout, "w", encoding="utf-8") as outf:
+            for count, word in counts:
+                line = word + " " + str(count) + "\n"
+                outf.write(line)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+"""
+Sidecar index of a passage tsv (one passage per line, see PassageExtraction.py), so any row can be read without
+scanning the file from the top.
+<tsv>.offsets holds the size and modification time (ns) of the tsv it was built from, then the byte offset of every
+row plus the end of the file (8 byte unsigned ints), and <tsv>.keys holds the year and source file of every row
+(tab separated, one line per row).
+
+python passage_index.py <passage tsv>   builds the index
+"""
+import mmap
+import os
+import sys
+from array import array
+
+
+def passage_source(line):
+    """
+    Gets the file name (without path) a passage came from
+    :param line: str- line of the passages tsv
+    :return: str- file name of the passage's source
+    """
+    file_path_parts = line.split("\t", 1)[0].split("/")
+    return file_path_parts[len(file_path_parts) - 1]
+
+
+def passage_year(line):
+    """
+    Gets the year of a passage from its source file name (e.g. 10-K_20170301_....txt)
+    :param line: str- line of the passages tsv
+    :return: str- year of the passage, "" if the file name has no date part
+    """
+    name_parts = passage_source(line).split("_")
+    if len(name_parts) < 2:
+        return ""
+    return name_parts[1][0:4]
+
+
+def build_index(tsv_name, keys=True):
+    """
+    Indexes a passage tsv in one sequential read
+    :param tsv_name: str- path to the passage tsv
+    :param keys: bool- also record the year and source file of every row
+    :return: int- number of rows
+    """
+    # Stat is taken before reading, so a tsv changed while it is indexed is reindexed next time
+    stat = os.stat(tsv_name)
+    offsets = array("Q", [stat.st_size, stat.st_mtime_ns])
+    with open(tsv_name, "rb") as tsv, open(tsv_name + ".keys.tmp", "w", encoding="utf-8") as key_file:
+        offset = 0
+        for raw_line in tsv:
+            offsets.append(offset)
+            offset += len(raw_line)
+            if keys:
+                line = raw_line.decode("utf-8")
+                key_file.write(passage_year(line) + "\t" + passage_source(line) + "\n")
+        offsets.append(offset)
+
+    with open(tsv_name + ".offsets.tmp", "wb") as offset_file:
+        offsets.tofile(offset_file)
+    os.replace(tsv_name + ".offsets.tmp", tsv_name + ".offsets")
+    if keys:
+        os.replace(tsv_name + ".keys.tmp", tsv_name + ".keys")
+    else:
+        os.remove(tsv_name + ".keys.tmp")
+    return len(offsets) - 3
+
+
+class PassageIndex:
+    """
+    Random access to the rows of an indexed passage tsv, by row number or by year or source file.
+    """
+
+    def __init__(self, tsv_name):
+        """
+        :param tsv_name: str- path to the passage tsv (indexed with build_index, reindexed if its size or
+                         modification time has changed)
+        """
+        self.tsv_name = tsv_name
+        if not os.path.exists(tsv_name + ".offsets"):
+            build_index(tsv_name)
+        header, self.offsets = self._load_offsets()
+        stat = os.stat(tsv_name)
+        if header != [stat.st_size, stat.st_mtime_ns]:
+            build_index(tsv_name, os.path.exists(tsv_name + ".keys"))
+            header, self.offsets = self._load_offsets()
+
+        self.tsv = open(tsv_name, "rb")
+        self.data = mmap.mmap(self.tsv.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] > 0 else b""
+        self.years = None
+        self.sources = None
+
+    def _load_offsets(self):
+        # Splits off the (size, modification time) header, an index without one never matches and is rebuilt
+        offsets = array("Q")
+        with open(self.tsv_name + ".offsets", "rb") as offset_file:
+            offsets.frombytes(offset_file.read())
+        if len(offsets) < 3:
+            return None, array("Q", [0])
+        return offsets[:2].tolist(), offsets[2:]
+
+    def _load_keys(self):
+        # Row numbers of each year and each source file, read the first time they are needed
+        if self.years is not None:
+            return
+        if not os.path.exists(self.tsv_name + ".keys"):
+            raise ValueError(self.tsv_name + " was indexed without keys")
+        self.years = {}
+        self.sources = {}
+        with open(self.tsv_name + ".keys", "r", encoding="utf-8") as key_file:
+            for row, line in enumerate(key_file):
+                year, source = line.rstrip("\n").split("\t")
+                self.years.setdefault(year, []).append(row)
+                self.sources.setdefault(source, []).append(row)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def row(self, row):
+        """
+        Reads one row
+        :param row: int- row number (from 0)
+        :return: str- line of the tsv
+        """
+        return self.data[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    def rows(self, rows):
+        """
+        Reads a set of rows
+        :param rows: iterable- row numbers
+        :return: lst- lines of the tsv, in the order of rows
+        """
+        return [self.row(row) for row in rows]
+
+    def year_rows(self, year):
+        """
+        :param year: str- year (e.g. "2017")
+        :return: lst- numbers of the rows of that year
+        """
+        self._load_keys()
+        return self.years.get(year, [])
+
+    def source_rows(self, source):
+        """
+        :param source: str- source file name without path
+        :return: lst- numbers of the rows from that source file
+        """
+        self._load_keys()
+        return self.sources.get(source, [])
+
+    def strata(self, stratify_by):
+        """
+        :param stratify_by: str- "year" or "source"
+        :return: dict- year or source file to the numbers of its rows
+        """
+        self._load_keys()
+        return {"year": self.years, "source": self.sources}[stratify_by]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.tsv.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    rows = build_index(sys.argv[1])
+    print("Indexed " + str(rows) + " rows")
+
+
+if __name__ == "__main__":
+    main()
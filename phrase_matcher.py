@@ -0,0 +1,136 @@
+"""
+Matches several named lexicons of words and multi-word phrases against a stream of word tokens in a single pass,
+using an Aho-Corasick automaton whose alphabet is (normalized) tokens instead of characters.
+"""
+from collections import deque
+
+
+class PhraseMatcher:
+    """
+    Compiled automaton over the phrases of one or more lexicons.
+    Feed it one normalized token at a time with step; it reports every phrase (of any lexicon) ending at that token.
+    """
+
+    def __init__(self, lexicons, normalize=None):
+        """
+        :param lexicons: dict- lexicon name to iterable of entries (words or whitespace separated phrases)
+        :param normalize: function- applied to each token of each entry (should match the normalization applied to
+                          the tokens that are fed in), None to use entries as they are
+        """
+        # Trie transitions, failure links, and (lexicon name, term, number of tokens) of the phrases ending at a node
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        self.max_length = 1
+        self.lexicon_names = list(lexicons)
+
+        for name, entries in lexicons.items():
+            for entry in entries:
+                tokens = entry.split()
+                if normalize is not None:
+                    tokens = [normalize(token) for token in tokens]
+                if len(tokens) == 0:
+                    continue
+                node = 0
+                for token in tokens:
+                    child = self.goto[node].get(token)
+                    if child is None:
+                        child = len(self.goto)
+                        self.goto[node][token] = child
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.outputs.append([])
+                    node = child
+                match = (name, " ".join(tokens), len(tokens))
+                if match not in self.outputs[node]:
+                    self.outputs[node].append(match)
+                self.max_length = max(self.max_length, len(tokens))
+
+        # Breadth first so a node's failure link is always finished before its children's
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(token, 0)
+                self.fail[child] = target if target != child else 0
+                # A node also ends every phrase its failure link ends (longest first)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def step(self, state, token):
+        """
+        Moves the automaton forward by one token
+        :param state: int- current state (0 at the start of a text)
+        :param token: str- next normalized token
+        :return: tuple- (int- new state, list- (lexicon name, term, number of tokens) of phrases ending at the token)
+        """
+        goto = self.goto
+        while state and token not in goto[state]:
+            state = self.fail[state]
+        state = goto[state].get(token, 0)
+        return state, self.outputs[state]
+
+    def find(self, tokens):
+        """
+        Finds every phrase in a list of normalized tokens
+        :param tokens: iterable- normalized tokens
+        :return: generator- (int- index of the phrase's last token, list- matches as returned by step)
+        """
+        state = 0
+        for index, token in enumerate(tokens):
+            state, matches = self.step(state, token)
+            if matches:
+                yield index, matches
+
+
+class PhraseJoiner:
+    """
+    Trie of phrases that joins every phrase in a list of tokens into a single token, in one left to right pass taking
+    the longest phrase starting at each token (e.g. ["line", "of", "credit"] -> ["line_of_credit"]).
+    """
+
+    def __init__(self, phrases, separator="_"):
+        """
+        :param phrases: iterable- phrases, written as their tokens joined by separator (e.g. "line_of_credit")
+        :param separator: str- joins the tokens of a phrase
+        """
+        self.separator = separator
+
+        # Nested dicts of tokens, a phrase ends at a node that has the key None
+        self.trie = {}
+        for phrase in phrases:
+            node = self.trie
+            for token in phrase.split(separator):
+                node = node.setdefault(token, {})
+            node[None] = True
+
+    def join(self, tokens):
+        """
+        Joins the phrases in a list of tokens
+        :param tokens: lst- normalized tokens
+        :return: lst- tokens with every phrase (greedy longest match) joined into one
+        """
+        trie = self.trie
+        joined = []
+        position = 0
+        while position < len(tokens):
+            # Most tokens start no phrase, which takes a single lookup
+            node = trie.get(tokens[position])
+            longest = 1
+            end = position + 1
+            while node is not None:
+                if None in node:
+                    longest = end - position
+                if end == len(tokens):
+                    break
+                node = node.get(tokens[end])
+                end += 1
+            if longest > 1:
+                joined.append(self.separator.join(tokens[position:position + longest]))
+            else:
+                joined.append(tokens[position])
+            position += longest
+        return joined
@@ -0,0 +1,182 @@
+"""
+Phrases learned by Ngram2.py (its frequent bigrams, and its frequent pairs of bigrams and words), saved as one compact
+file so they can be applied to any text without recounting the corpus.
+A model file (.npz) holds the sorted tokens of the phrases and each pass's pairs as sorted int ids
+(first token id * number of tokens + second token id).
+
+python phrase_model.py <model file> <directory of txt files> <output directory> [number of processes]
+python phrase_model.py <model file> <tsv> <output tsv> <column of the text> [number of processes]
+"""
+import os
+import sys
+import numpy as np
+from multiprocessing import Pool
+from tokenizer import lower_tokens
+
+# Per worker state of a parallel run (set by phraser_init)
+worker_model = None
+worker_column = None
+
+
+class PhraseModel:
+    """
+    Joins the learned phrases of a list of tokens, in the same two passes as Ngram2.filewriter: first frequent
+    bigrams, then frequent pairs of the result (which makes trigrams).
+    """
+
+    def __init__(self, bigram_pairs, trigram_pairs):
+        """
+        :param bigram_pairs: set- (token, token) pairs joined in the first pass
+        :param trigram_pairs: set- (token, token) pairs joined in the second pass
+        """
+        self.passes = [frozenset(bigram_pairs), frozenset(trigram_pairs)]
+
+    def phrase(self, tokens):
+        """
+        :param tokens: lst- lowercase tokens (see tokenizer.lower_tokens)
+        :return: lst- tokens with the phrases joined by "_"
+        """
+        for pairs in self.passes:
+            updated_tokens = []
+            previous_token = None
+            for token in tokens:
+                if previous_token and (previous_token, token) in pairs:
+                    token = previous_token + '_' + token
+                    updated_tokens[-1] = token
+                else:
+                    updated_tokens.append(token)
+                previous_token = token
+            tokens = updated_tokens
+        return tokens
+
+    def phrase_text(self, text):
+        """
+        :param text: str- raw text
+        :return: str- its lowercase tokens, phrases joined, separated by spaces
+        """
+        return " ".join(self.phrase(lower_tokens(text)))
+
+
+def save_model(model_file, model):
+    """
+    Writes a model (atomically)
+    :param model_file: str- path of the model file (.npz)
+    :param model: PhraseModel- model to save
+    :return: None
+    """
+    tokens = sorted(set(token for pairs in model.passes for pair in pairs for token in pair))
+    token_ids = {token: token_id for token_id, token in enumerate(tokens)}
+    size = len(tokens)
+    pair_ids = [np.array(sorted(token_ids[first] * size + token_ids[second] for first, second in pairs),
+                         dtype=np.int64) for pairs in model.passes]
+    with open(model_file + ".tmp", "wb") as outf:
+        np.savez_compressed(outf, tokens=np.array(tokens, dtype=str), bigrams=pair_ids[0], trigrams=pair_ids[1])
+    os.replace(model_file + ".tmp", model_file)
+
+
+def load_model(model_file):
+    """
+    Reads a model
+    :param model_file: str- path of the model file (.npz)
+    :return: PhraseModel- the model
+    """
+    with np.load(model_file) as saved:
+        tokens = saved["tokens"].tolist()
+        size = len(tokens)
+        passes = [set((tokens[pair_id // size], tokens[pair_id % size]) for pair_id in saved[name].tolist())
+                  for name in ("bigrams", "trigrams")]
+    return PhraseModel(passes[0], passes[1])
+
+
+def phraser_init(model_file, column=None):
+    """
+    Loads the model in a pool worker
+    :param model_file: str- path of the model file
+    :param column: int- column of the text when phrasing a tsv
+    :return: None
+    """
+    global worker_model, worker_column
+    worker_model = load_model(model_file)
+    worker_column = column
+
+
+def phrase_file_task(task):
+    """
+    Phrases a text file
+    :param task: tuple- (str- path of the text file, str- path of the phrased file)
+    :return: str- path of the phrased file
+    """
+    in_name, out_name = task
+    with open(in_name, encoding="utf-8") as inf:
+        text = inf.read()
+    with open(out_name, "w", encoding="utf-8") as outf:
+        outf.write(worker_model.phrase_text(text))
+    return out_name
+
+
+def phrase_tsv_line(line):
+    """
+    Phrases the text column of a tsv line
+    :param line: str- line of the tsv
+    :return: str- the line with its text column phrased
+    """
+    line_parts = line.rstrip("\n").split("\t")
+    line_parts[worker_column] = worker_model.phrase_text(line_parts[worker_column])
+    return "\t".join(line_parts) + "\n"
+
+
+def phrase_files(model_file, file_names, output_dir, processes):
+    """
+    Phrases text files in parallel, writing <name>_ngrammed.txt for each <name>.txt
+    :param model_file: str- path of the model file
+    :param file_names: lst- paths of the text files
+    :param output_dir: str- directory of the phrased files
+    :param processes: int- number of worker processes
+    :return: None
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(file_name, os.path.join(output_dir, os.path.basename(file_name)[:-4] + "_ngrammed.txt"))
+             for file_name in file_names]
+    pool = Pool(processes, initializer=phraser_init, initargs=(model_file,))
+    for _ in pool.imap_unordered(phrase_file_task, tasks):
+        pass
+    pool.close()
+    pool.join()
+
+
+def phrase_tsv(model_file, tsv_name, outfile_name, column, processes):
+    """
+    Phrases one column of a tsv in parallel, streaming it through in order
+    :param model_file: str- path of the model file
+    :param tsv_name: str- path of the tsv
+    :param outfile_name: str- path of the phrased tsv
+    :param column: int- column of the text
+    :param processes: int- number of worker processes
+    :return: None
+    """
+    pool = Pool(processes, initializer=phraser_init, initargs=(model_file, column))
+    with open(tsv_name, "r", encoding="utf-8") as inf, open(outfile_name, "w", encoding="utf-8") as outf:
+        for line in pool.imap(phrase_tsv_line, inf, chunksize=256):
+            outf.write(line)
+    pool.close()
+    pool.join()
+
+
+def main():
+    model_file = sys.argv[1]
+    input_name = sys.argv[2]
+    output_name = sys.argv[3]
+    if os.path.isdir(input_name):
+        processes = int(sys.argv[4]) if len(sys.argv) > 4 else os.cpu_count()
+        file_names = []
+        for root, dirs, files in os.walk(input_name):
+            for file in files:
+                file_names.append(os.path.join(root, file))
+        phrase_files(model_file, file_names, output_name, processes)
+    else:
+        processes = int(sys.argv[5]) if len(sys.argv) > 5 else os.cpu_count()
+        phrase_tsv(model_file, input_name, output_name, int(sys.argv[4]), processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,15 @@ Graphs the ratio of the numbers of uses of words from a given lexicon to the tot
 year based on the BSE annual reports corpus.
 """
 import glob
-import regex
 import csv
+import os
+from collections import Counter
 from multiprocessing import Pool
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
-import nltk
+from scipy import sparse
+from tokenizer import lower_tokens
 
 
 # Creates lexicon set from lowercased file with lexicon in it
@@ -21,73 +23,154 @@ with open(lexicon_file_name) as lex:
 
 # Creates set of files to count words from
 path = "/data/annual_reports_tesseract/*.txt"
-text_files = glob.glob(path)
+text_files = sorted(glob.glob(path))
+
+# Cached (file x term) count matrix over every term of the corpus and its per file details (file names, sizes,
+# modification times, years, and token totals), with the terms of its columns in a text file (one per line, since a
+# numpy string array is as wide as its longest term). Any lexicon, subset, or weighting is a selection of its columns,
+# so it is only rebuilt when the files change.
+count_matrix_file = "lexicon_counts.npz"
+count_details_file = "lexicon_counts_details.npz"
+count_terms_file = "lexicon_counts_terms.txt"
 
 
 def unigrams(filename):
     """
-    Gets the counts of lexicon words for a given year from a single file
+    Gets the counts of each word in a single file
     :param filename: str- The name (inclusive of path) of the file being counted
-    :return: tuple- (int- year, int- total number of words in file, int- total number of lexicon words in file)
+    :return: tuple- (int- year, int- total number of words in file, Counter- count of each word in the file)
     """
     # Get year from file name
     filename_split = filename.split("_")
-    print(filename_split)
     year = int(filename_split[3][0:4])
 
-    # Initialize count
-    desired_word_count = 0
-
     with open(filename, encoding="utf-8") as f:
         # Read in and tokenizes text
         text = f.read()
-        tokens = regex.findall(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*", text)
-        
-        # Since each word should be a token, the total words will be the total tokens
-        tot_words = len(tokens)
+        tokens = lower_tokens(text)
 
-        # Creates a dictionary of lowercase words to their counts in the token list
-        freq_dist = nltk.FreqDist([token.lower() for token in tokens])
+    # Since each word should be a token, the total words will be the total tokens
+    tot_words = len(tokens)
 
-        # Gets the total amount of lexicon words that were in the file based on frequency distribution counts
-        for elem in lexicon:
-            desired_word_count += freq_dist[elem]
+    return year, tot_words, Counter(tokens)
 
-        # Memory Cleanup
-        del freq_dist
-    return year, int(tot_words), int(desired_word_count)
 
+def file_stats(files):
+    """
+    :param files: lst- paths of files
+    :return: tuple- (np.ndarray- size of each file, np.ndarray- modification time (ns) of each file)
+    """
+    stats = [os.stat(filename) for filename in files]
+    return (np.array([stat.st_size for stat in stats], dtype=np.int64),
+            np.array([stat.st_mtime_ns for stat in stats], dtype=np.int64))
 
-def full_counts():
+
+def build_count_matrix():
     """
-    Creates dictionaries with years as keys where each year has the corresponding number of total words or lexicon
-    words (dependent on dictionary)
-    :return: tuple- (dict- year-to-lexiconWordCount, dict- year-to-TotalWordCount)
+    Counts every term in every text file in one pass over the corpus and caches the result
+    :return: tuple- (sparse.csr_matrix- count of each term (column) in each file (row), lst- term of each column,
+             np.ndarray- year of each file, np.ndarray- total words in each file)
     """
-    # Initialize the year-to-count dictionary for the total words and desired words
-    tot_words_per_year = {}
-    desired_words_per_year = {}
-    for year in range(2010, 2020):
-        tot_words_per_year[year] = 0
-        desired_words_per_year[year] = 0
+    # Stats are taken before counting, so a file changed while it is counted is recounted next time
+    sizes, mtimes = file_stats(text_files)
+
+    # Column of each term, in the order terms are first seen
+    term_ids = {}
+    columns = []
+    values = []
+    row_lengths = np.zeros(len(text_files), dtype=np.int64)
+    years = np.zeros(len(text_files), dtype=np.int64)
+    totals = np.zeros(len(text_files), dtype=np.int64)
 
     # Multiprocessing used to make counting in files more efficient
     count_pool = Pool(35)
-    counts_list = count_pool.map(unigrams, text_files)
+    for row, (year, tot_words, term_counts) in enumerate(count_pool.imap(unigrams, text_files, chunksize=16)):
+        years[row] = year
+        totals[row] = tot_words
+        row_lengths[row] = len(term_counts)
+        columns.append(np.fromiter((term_ids.setdefault(term, len(term_ids)) for term in term_counts.keys()),
+                                   dtype=np.int64, count=len(term_counts)))
+        values.append(np.fromiter(term_counts.values(), dtype=np.int64, count=len(term_counts)))
     count_pool.close()
     count_pool.join()
 
-    # Ensures proper formatting of list as well as a good progress check
-    print(counts_list)
+    row_starts = np.concatenate(([0], np.cumsum(row_lengths)))
+    matrix = sparse.csr_matrix((np.concatenate(values + [np.zeros(0, dtype=np.int64)]),
+                                np.concatenate(columns + [np.zeros(0, dtype=np.int64)]), row_starts),
+                               shape=(len(text_files), len(term_ids)))
+    matrix.sort_indices()
+    terms = list(term_ids)
+
+    # Tokens never hold whitespace, so one term per line is unambiguous. The details go last, as a cache is only used
+    # once they match the files.
+    with open(count_terms_file, "w", encoding="utf-8") as terms_out:
+        terms_out.write("\n".join(terms))
+    sparse.save_npz(count_matrix_file, matrix)
+    np.savez(count_details_file, files=np.array(text_files, dtype=str), sizes=sizes, mtimes=mtimes, years=years,
+             totals=totals)
+    return matrix, terms, years, totals
+
+
+def load_count_matrix():
+    """
+    Loads the cached count matrix, or builds it if it is missing or out of date (once, a build is used even if files
+    changed while it counted, they are recounted on the next run)
+    :return: tuple- (sparse.csr_matrix- count of each term (column) in each file (row), lst- term of each column,
+             np.ndarray- year of each file, np.ndarray- total words in each file)
+    """
+    if os.path.exists(count_matrix_file) and os.path.exists(count_details_file) and os.path.exists(count_terms_file):
+        with np.load(count_details_file) as details:
+            cached = {name: details[name] for name in details.files}
+        sizes, mtimes = file_stats(text_files)
+        if cached["files"].tolist() == text_files and np.array_equal(cached["sizes"], sizes) and \
+                np.array_equal(cached["mtimes"], mtimes):
+            with open(count_terms_file, "r", encoding="utf-8") as terms_in:
+                terms_text = terms_in.read()
+            terms = terms_text.split("\n") if terms_text else []
+            return sparse.load_npz(count_matrix_file), terms, cached["years"], cached["totals"]
 
-    # adds up counts to proper years in year-to-count dictionaries
-    for (y, t, d) in counts_list:
-        if y != 2009:
-            tot_words_per_year[y] += t
-            desired_words_per_year[y] += d
+    return build_count_matrix()
+
+
+def yearly_counts(matrix, terms, years, totals, lexicon_terms, weights=None):
+    """
+    Adds up the (weighted) lexicon words and the total words of every year, as sums over the count matrix
+    :param matrix: sparse.csr_matrix- count matrix (see load_count_matrix)
+    :param terms: lst- term of each column
+    :param years: np.ndarray- year of each file
+    :param totals: np.ndarray- total words in each file
+    :param lexicon_terms: iterable- terms to count (terms that are not columns never occur in the corpus)
+    :param weights: dict- weight of each term, None to count every term once
+    :return: tuple- (dict- year-to-lexiconWordCount, dict- year-to-TotalWordCount)
+    """
+    column_weights = np.zeros(len(terms), dtype=np.int64 if weights is None else np.float64)
+    columns = {term: column for column, term in enumerate(terms)}
+    for term in lexicon_terms:
+        if term not in columns:
+            continue
+        column_weights[columns[term]] = 1 if weights is None else weights.get(term, 0)
+    desired_per_file = matrix @ column_weights
+
+    desired_words_per_year = {}
+    tot_words_per_year = {}
+    for year in range(2010, 2020):
+        in_year = years == year
+        desired_words_per_year[year] = desired_per_file[in_year].sum().item()
+        tot_words_per_year[year] = int(totals[in_year].sum())
     return desired_words_per_year, tot_words_per_year
 
 
+def full_counts():
+    """
+    Creates dictionaries with years as keys where each year has the corresponding number of total words or lexicon
+    words (dependent on dictionary)
+    :return: tuple- (dict- year-to-lexiconWordCount, dict- year-to-TotalWordCount)
+    """
+    # Counts come from the cached count matrix, so the corpus is only read when it changes
+    matrix, terms, years, totals = load_count_matrix()
+    return yearly_counts(matrix, terms, years, totals, lexicon)
+
+
 def graph_full_counts():
     """
     Graphs the ratio of lexicon words to total words for the annual reports of a given year.
@@ -1,10 +1,10 @@
-import regex
 import csv
 from multiprocessing import Pool
 import numpy as np
 import matplotlib.pyplot as plt
 import nltk
 from collections import defaultdict
+from tokenizer import lower_tokens
 
 
 # Creates lexicon set
@@ -48,11 +48,11 @@ def passage_relation(line):
 
     # Tokenizes text
     text = line_parts[2]
-    tokens = regex.findall(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*", text)
+    tokens = lower_tokens(text)
 
     # If a desired word is in the passage, return true
     for elem in tokens:
-        if elem.lower() in desired_list:
+        if elem in desired_list:
             return year, True
 
     return year, False
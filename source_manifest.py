@@ -0,0 +1,70 @@
+"""
+Manifest of the source files a stage has already processed (size, modification time and content hash of each, plus
+the parameters the stage ran with), so a rerun only processes new or changed sources and cleans up after removed ones.
+"""
+import json
+import os
+from ocr_cache import file_hash
+
+
+def load_manifest(manifest_file):
+    """
+    Reads a manifest
+    :param manifest_file: str- path to the manifest (json)
+    :return: dict- {"params": dict of stage parameters, "sources": dict of source path to its entry}
+    """
+    if not os.path.exists(manifest_file):
+        return {"params": None, "sources": {}}
+    with open(manifest_file, "r", encoding="utf-8") as inf:
+        return json.load(inf)
+
+
+def save_manifest(manifest_file, manifest):
+    """
+    Writes a manifest (atomically, so a crash never leaves a half written manifest)
+    :param manifest_file: str- path to the manifest (json)
+    :param manifest: dict- manifest (see load_manifest)
+    :return: None
+    """
+    temp_file = manifest_file + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as outf:
+        json.dump(manifest, outf)
+    os.replace(temp_file, manifest_file)
+
+
+def source_entry(source, known=None):
+    """
+    Builds the manifest entry of a source file, only rehashing it if its size or modification time changed
+    :param source: str- path to the source file
+    :param known: dict- the source's entry from the last run, None if it is new
+    :return: dict- entry with keys size, mtime, hash
+    """
+    stat = os.stat(source)
+    if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime_ns:
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": known["hash"]}
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_hash(source)}
+
+
+def plan_run(manifest, sources, params):
+    """
+    Works out what a run has to do. Every source is to be processed if the parameters changed since the last run.
+    :param manifest: dict- manifest of the last run (see load_manifest)
+    :param sources: lst- paths of all current source files
+    :param params: dict- parameters of this run
+    :return: tuple- (lst- sources to process, lst- sources that were removed, dict- entries of all current sources
+             (an entry keeps any extra keys stored by the last run, e.g. its number of chunks))
+    """
+    same_params = manifest["params"] == params
+    known_sources = manifest["sources"]
+    to_process = []
+    entries = {}
+    for source in sources:
+        known = known_sources.get(source)
+        entry = source_entry(source, known)
+        if known is not None:
+            entry = dict(known, **entry)
+        if not same_params or known is None or known["hash"] != entry["hash"]:
+            to_process.append(source)
+        entries[source] = entry
+    removed = [source for source in known_sources if source not in entries]
+    return to_process, removed, entries
@@ -0,0 +1,111 @@
+"""
+Tokenization and word normalization shared by every stage, so the token pattern is compiled once and every script
+splits text into the same tokens.
+A token is a run of letters, optionally joined by single punctuation marks (e.g. "don't", "u.s", "cash_flow").
+
+Run on its own to time it against the inline code it replaces:
+python tokenizer.py [text file]
+"""
+import re
+import regex
+import string
+import sys
+import time
+from functools import lru_cache
+
+# Tokens of any text (unicode letters and POSIX punctuation)
+token_pattern = regex.compile(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*")
+
+# The same tokens for ascii only text (ascii letters and the 32 ascii punctuation marks), on the faster re engine
+ascii_token_pattern = re.compile(r"[A-Za-z](?:[!-/:-@\[-`{-~]?[A-Za-z])*")
+
+# Number of distinct words whose normalized form is remembered by normalize_word
+normalize_cache_size = 1 << 18
+
+
+def tokenize(text):
+    """
+    Splits text into tokens, keeping their case
+    :param text: str- text to tokenize
+    :return: lst- tokens in order
+    """
+    if text.isascii():
+        return ascii_token_pattern.findall(text)
+    return token_pattern.findall(text)
+
+
+def lower_tokens(text):
+    """
+    Splits text into lowercase tokens (same as [token.lower() for token in tokenize(text)])
+    :param text: str- text to tokenize
+    :return: lst- lowercase tokens in order
+    """
+    # Lowercasing ascii text never changes where tokens start or end, so the whole text is lowered at once
+    if text.isascii():
+        return ascii_token_pattern.findall(text.lower())
+    return [token.lower() for token in token_pattern.findall(text)]
+
+
+@lru_cache(maxsize=normalize_cache_size)
+def normalize_word(word):
+    """
+    Lowercases a whitespace separated word and strips the punctuation around it, so it can be compared to lexicon words.
+    Remembers the most recent words, since the same surface forms repeat throughout a corpus.
+    :param word: str- a word
+    :return: str- de-punctuated lowercase word
+    """
+    lowered = word.lower()
+    return lowered.strip(string.punctuation).strip(string.whitespace)
+
+
+def benchmark(text, repeats=5):
+    """
+    Times the shared tokenizer against the inline code it replaced, and checks both give the same tokens
+    :param text: str- text to tokenize
+    :param repeats: int- runs of each, the best is reported
+    :return: None
+    """
+    def best_time(function):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def inline_lower_tokens():
+        tokens = regex.findall(r"\p{IsAlphabetic}(?:[[:punct:]]?\p{IsAlphabetic})*", text)
+        return [token.lower() for token in tokens]
+
+    words = text.split()
+
+    def inline_word_process():
+        return [word.lower().strip(string.punctuation).strip(string.whitespace) for word in words]
+
+    def cached_word_process():
+        return [normalize_word(word) for word in words]
+
+    assert inline_lower_tokens() == lower_tokens(text)
+    assert inline_word_process() == cached_word_process()
+
+    print("{0} characters, {1} words".format(len(text), len(words)))
+    for name, old, new in (("lowercase tokens", inline_lower_tokens, lambda: lower_tokens(text)),
+                           ("word_process", inline_word_process, cached_word_process)):
+        old_time = best_time(old)
+        new_time = best_time(new)
+        print("{0}: inline {1:.3f}s, shared {2:.3f}s ({3:.1f}x)".format(name, old_time, new_time, old_time / new_time))
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = ("The Company's line of credit (the \"Facility\") matures in 2019; cash-flow from operations, "
+                "net of capital expenditures, was $4.2 million. Risk factors: U.S. tariffs & supply_chain delays.\n"
+                * 20000)
+    benchmark(text)
+
+
+if __name__ == "__main__":
+    main()